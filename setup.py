@@ -28,7 +28,9 @@ setup(name='squash_python',
       # -*- Entry points: -*-
       [console_scripts]
       squash_tester=squash_python.squash_tester:main
+      squash_forwarder=squash_python.forwarder:main
       squash_release=squash_python.squash_release:main
+      squash_spool=squash_python.squash_spool:main
 
       """,
       )
@@ -64,12 +64,78 @@ below)
 the `hook` method uses `sys.excepthook` to add the uncaught-exception handler
 that allows Squash to record new crashes.
 
+On Python 3.8 and later, ``client.hook(threads=True, unraisable=True)`` also records exceptions
+that end a `threading.Thread`, and those Python can't raise, such as from `__del__` methods. To
+record the exception of a `concurrent.futures` task that nothing ever retrieves, wrap the call
+to `submit`: ``client.watchFuture(executor.submit(work, item))``. It is recorded once the future
+is garbage collected, unless its `result` or `exception` was called. These exceptions
+are recorded by a background thread, so the failing thread never waits on a lock or the disk.
+Every occurrence recorded by a hook carries the name of its thread as `thread_name` and how it was
+caught as `origin` (``excepthook``, ``thread``, ``unraisable`` or ``future``).
+
 A third method `recordException` can be used to report non-fatal exceptions
 caught by your application. Its arguments are the same as those provided by `sys.exc_info`
 and accepted by `sys.excepthook`. Typical usage::
 
     client.reportException(*sys.exc_info())
 
+If your application reports errors through the `logging` module, add a `SquashHandler` to
+a logger instead. Every record logged with exception info, such as by `logging.Logger.exception`,
+is recorded along with its message and logger name::
+
+    logging.getLogger().addHandler(squash_python.SquashHandler())
+
+Pass ``errorLevel=logging.ERROR`` to also record error messages that have no exception attached.
+The handler never blocks the logging thread: records are queued and saved in the background, and
+repeats of the same record within a minute are counted rather than saved again.
+
+Web frameworks catch exceptions raised while handling a request, so they never reach `hook`.
+Wrap your WSGI or ASGI application in `SquashWSGIMiddleware` or `SquashASGIMiddleware` to
+record them, along with the request method, path, query, headers and duration::
+
+    application = squash_python.SquashWSGIMiddleware(application)
+
+Sensitive headers such as ``Authorization`` and ``Cookie`` are redacted, and `filterStrings`
+are removed from the rest.
+
+To find out about hangs as well as crashes, call ``client.startWatchdog(threshold=5.0)``. If
+the main thread stays in the same function call for `threshold` seconds, without returning or
+calling anything else, an occurrence of class ``Stall`` is recorded with the stacks of all
+threads. That catches a loop that never ends as well as a wait on a lock that is never released.
+Waits for events in `threading`, `queue` or `selectors` (as in an idle asyncio loop) aren't
+stalls; where the main thread only sleeps or waits for a signal, do so in
+``with client.watchdog.idle():``. Use
+``client.watchLoop(loop)`` to watch an asyncio event loop in the same way; it is reported as an
+``Event Loop Stall`` when a scheduled callback doesn't run in time. Each stall is reported
+once, and at most every five minutes.
+
+``client.installDumpSignal()`` records the stacks of all threads as a ``Stack Dump`` occurrence
+whenever the process receives ``SIGUSR1``, and then lets it carry on.
+
+To find out about performance regressions, time the operations that matter with ``client.timed``,
+as a decorator or a context manager::
+
+    @client.timed(threshold=0.2)
+    def render_page(request):
+        ...
+
+    with client.timed("nightly export", threshold=600):
+        export()
+
+Whenever one takes longer than `threshold` seconds, an occurrence of class ``Slow Operation`` is
+recorded with the stack, the elapsed time and the threshold. Pass ``sampleRate`` to report only a
+fraction of slow runs; each operation is reported at most once a minute (``reportInterval``).
+Operations that finish in time cost no more than reading the clock twice.
+
+Exceptions that your code catches and swallows never reach Squash. On Python 3.12 and later,
+``client.startRaiseSampler(["myapp"])`` counts every exception raised in the ``myapp`` package,
+caught or not, using `sys.monitoring`. Once a minute (``flushInterval``), one occurrence is
+recorded for each exception class and raising line. It has the number of raises as `raise_count`,
+a sample stack, and ``origin`` set to ``raise_sampler``. Stacks are captured for at most
+``samplesPerSecond`` new locations a second. The sampler estimates its own share of run time,
+sent as `sampler_overhead`. It turns itself off if that goes above ``maxOverhead`` (by default
+1%) or more than ``maxRaisesPerSecond`` exceptions (by default 10000) are raised in a second.
+
 Configuration
 -------------
 
@@ -134,17 +200,77 @@ The following attributes are available:
   removed and replaced with ~
 
 `args`:
-  Dictionary of additional keys and values to add to each reported occurrence.
+  Dictionary of additional keys and values to add to each reported occurrence. They override
+  the other fields of the occurrence. The process and machine details sent with each occurrence,
+  such as `arguments` and `env_vars`, are gathered once per process, when the first occurrence is
+  recorded (or by `hook` if `memoryReserve` is set), so later changes to the environment aren't sent.
+
+`localsCapture`:
+  If set to a `LocalsCapture`, the local variables of the innermost frames are sent
+  with each occurrence as `frame_locals`. By default, it's `None` (disabled). Values are cut to
+  a fixed length, capture stops at a total size and time budget, and variables with names like
+  ``*password*`` or ``*token*`` are redacted. For example,
+  ``client.localsCapture = squash_python.LocalsCapture(frames=3)``
+
+`sourceContext`:
+  The number of source lines before and after each backtrace line to send as
+  `source_context`. By default, it's 0 (disabled). Source files are read by `reportErrors`,
+  not when the error is recorded, and each file is read at most once per call. No context is sent
+  for occurrences recorded at a different `revision`, or for files modified since the error.
+
+`forwarderSocket`:
+  The path of the Unix domain socket of a ``squash_forwarder`` daemon. By default, it's `None`.
+  When set, occurrences are handed to the daemon, which uploads them for every process on the
+  host over a shared pool of connections. If the daemon isn't running or is full, occurrences
+  are saved to disk as usual. They are only sent to a daemon running as the same user or root.
+
+`forwarderUids`:
+  Other user IDs a ``squash_forwarder`` daemon may run as, such as that of a dedicated ``squash``
+  user serving several applications. By default, it's empty.
+
+`captureBudget`:
+  The number of seconds recording an occurrence may take. By default, it's 1 second; `None`
+  removes the limit. Occurrences that would take longer are sent with less detail instead: past
+  half the budget, only the innermost frames and the start of the message are kept, and past the
+  whole budget only the class name, message start and innermost frame, with the required fields
+  and `args` but without the process and platform details. The level used is sent as
+  `capture_level` (``full``, ``trimmed`` or ``minimal``). An exception whose `__str__` doesn't
+  finish within the budget is recorded with a placeholder message.
+
+`drainBytesPerSecond`, `drainRequestsPerSecond`:
+  Limits on how fast `reportErrors` sends saved occurrences. By default, both are `None` (no limit).
+  Occurrences are always sent most urgent first: signals, then uncaught exceptions, then handled
+  ones, oldest first within each.
+
+`drainTimeSlice`:
+  If set, `reportErrors` returns after this many seconds, leaving the remaining occurrences for
+  its next call. It can also be passed to a single call as ``reportErrors(timeSlice=...)``.
+
+`memoryReserve`:
+  A number of bytes that `hook` sets aside and frees when a `MemoryError` is recorded, so there is
+  memory left to record it with, e.g. ``1024 * 1024``. When it is set, a `MemoryError` is recorded
+  as a minimal occurrence that keeps its whole backtrace. By default, it's `None`, reserving nothing,
+  and a `MemoryError` is recorded like any other exception.
+
+`memoryTraceTop`:
+  If `memoryReserve` is set and the application has started `tracemalloc`, a `MemoryError` is
+  recorded with the source lines holding the most memory as `allocation_summary`, this many of
+  them. By default, it's 10.
 
 Command-Line Utilities
 ----------------------
 
-The ``squash_python`` module also installs two command line scripts called ``squash_release``
-and ``squash_tester``.
+The ``squash_python`` module also installs four command line scripts called ``squash_release``,
+``squash_tester``, ``squash_spool`` and ``squash_forwarder``.
 
 You *must* use ``squash_release`` to notify Squash of a new deployment. Run ``squash_release`` to
 have it print its usage information.
 
+To notify several projects or environments at once, list them in a JSON manifest and pass it
+with ``squash_release -m manifest.json``. Each entry is an object with the keys ``host``,
+``api_key`` and ``environment``. The notifications are sent concurrently, and the revision is
+read from the repository in the current (or ``-p``) directory unless ``-r`` is given.
+
 You can use ``squash_tester`` to test your Squash integration, or as a template to integrating
 Squash into your own project. The easiest way to use ``squash_tester`` is to
 run the Squash web server locally on port 3000, and set the environment variable
@@ -155,17 +281,39 @@ run `squash_tester -s` to report an unhandled signal.
 If the server is running elsewhere, you may set the environment variable ``SQUASH_TESTER_HOST``
  to the method, host and port of the server (e.g. "https://squash.example.com:3000")
 
+To measure the client's overhead, run ``squash_tester -L``. It records exceptions at a fixed
+rate (``--rate``) for ``--duration`` seconds from ``--threads`` threads in each of ``--processes``
+processes, then sends them all to the server and prints recording latency percentiles and
+throughput. ``--depth``, ``--message-size`` and ``--fingerprints`` shape each occurrence.
+
+Use ``squash_spool`` to look at the occurrences waiting in ``~/.SquashOccurrences``.
+``squash_spool stats`` counts them by age, class and fingerprint, and ``squash_spool list``
+shows one per line. ``export`` and ``import`` move them between hosts as newline-delimited JSON,
+``replay HOST`` sends them to a server, and ``purge`` deletes them. Most commands accept filters
+such as ``--class``, ``--fingerprint`` and ``--older-than 7d``; run ``squash_spool COMMAND -h``
+for details.
+
+``squash_forwarder`` runs the daemon used with `forwarderSocket`. Give it the Squash servers it
+may send to with ``-H https://your.squash.host`` (repeated for several); occurrences for any
+other server are refused. By default it listens on ``squash_forwarder.sock`` in
+``$XDG_RUNTIME_DIR``, or else in a folder private to the user in the system's temporary folder.
+To serve other users, pass ``-s`` with a path in a folder they can reach, and ``-m 666``.
+Occurrences it can't send are saved to its own ``~/.SquashOccurrences``, or the folder given
+with ``-d``, and it tries to send them again every minute (see ``-r``).
+
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 import codecs
 from datetime import datetime
+import errno
 import json
 import logging
 import signal
 import os
 import platform
 import sys
+import threading
 try:
     import urllib2 as urlerror
 except ImportError:
@@ -173,8 +321,20 @@ except ImportError:
 
 import uuid
 
-from squash_python.occurrence import Occurrence
+from squash_python.occurrence import Occurrence, FATAL_PRIORITY, allocation_summary, capture_levels, clock, exception_message
+from squash_python.frame_locals import LocalsCapture
+from squash_python.source_context import add_source_context, get_shared_cache
 from squash_python.uploader import SquashUploader
+from squash_python.forwarder import send_occurrence
+from squash_python.drain import DrainScheduler
+from squash_python.watchdog import StallWatchdog, dump_occurrence
+from squash_python.timing import SlowOperation
+from squash_python.capture import CaptureQueue, FutureWatch, describe_object, release_frames
+from squash_python.raise_sampler import RaiseSampler
+from squash_python.handler import SquashHandler
+from squash_python.middleware import SquashWSGIMiddleware
+if sys.version_info >= (3, 5):
+    from squash_python.asgi import SquashASGIMiddleware
 
 log = logging.getLogger(__name__)
 
@@ -226,10 +386,30 @@ class SquashClient(object):
         self.timeout = 15
         self.disabled = False
         self.args = {}
-
-    def hook(self):
+        self.localsCapture = None
+        self.sourceContext = 0
+        self.forwarderSocket = None
+        self.forwarderUids = ()
+        self.captureBudget = 1.0
+        self._writeCost = None
+        self.drainBytesPerSecond = None
+        self.drainRequestsPerSecond = None
+        self.drainTimeSlice = None
+        self.watchdog = None
+        self.memoryReserve = None
+        self.memoryTraceTop = 10
+        self._reserve = None
+        self.captureQueue = CaptureQueue(self)
+        self.raiseSampler = None
+
+    def hook(self, threads=False, unraisable=False):
         """
         Install the client's exception hook and signal handlers.
+
+        If `threads` is True, also record exceptions that end a `threading.Thread` (see
+        :func:`threading.excepthook`), and if `unraisable` is True, those Python can't raise, such as
+        from `__del__` (see :func:`sys.unraisablehook`). Both need Python 3.8 or later, and the hooks
+        they replace are still called. These exceptions are recorded in the background by `captureQueue`.
         """
         if not (self.revision):
             raise ValueError("SquashClient needs a revision.")
@@ -246,21 +426,107 @@ class SquashClient(object):
         for signum in self.handledSignals:
             self.old_handlers[signum] = signal.signal(signum, self.sighandler)
 
-    def recordException(self, exc_type, exc_value, exc_traceback):
+        if threads:
+            if hasattr(threading, 'excepthook'):
+                self.old_threading_excepthook = threading.excepthook
+                threading.excepthook = self.threadExcepthook
+            else:
+                log.warn("threading.excepthook needs Python 3.8; exceptions in threads won't be recorded")
+        if unraisable:
+            if hasattr(sys, 'unraisablehook'):
+                self.old_unraisablehook = sys.unraisablehook
+                sys.unraisablehook = self.unraisablehook
+            else:
+                log.warn("sys.unraisablehook needs Python 3.8; unraisable exceptions won't be recorded")
+
+        if self.memoryReserve:
+            self.reserveMemory()
+
+    def reserveMemory(self):
+        """
+        Set aside `memoryReserve` bytes to be freed when a `MemoryError` is recorded, and gather ahead of
+        time what recording it needs, so the occurrence can still be saved when memory has run out.
+        Called by `hook`, and again after each `MemoryError` is recorded.
+        """
+        self.get_process_fields()
+        self.get_occurrence_folder()
+        # Filled in rather than merely allocated, so the pages really are held and can be given back.
+        self._reserve = b"\0" * self.memoryReserve
+
+    def recordException(self, exc_type, exc_value, exc_traceback, args=None, fatal=False):
         """
         Given the three values passed into :func:`sys.excepthook` or obtainable from :func:`sys.exc_info`,
         record an occurrence of the exception.
 
-        This may be called by the application to report a nonfatal exception.
+        This may be called by the application to report a nonfatal exception. `args` is an optional
+        dictionary of additional keys and values to add to this occurrence. Occurrences with `fatal` set
+        are sent before nonfatal ones by `reportErrors`.
         """
         if self.disabled:
             return
 
-        if exc_type.__name__ in self.ignoredExceptions or exc_type in self.ignoredExceptions:
+        if self.isIgnored(exc_type):
             return
 
-        occ = Occurrence.from_exception(exc_type, exc_value, exc_traceback)
-        self.record(occ)
+        if self.memoryReserve and issubclass(exc_type, MemoryError):
+            self.recordMemoryError(exc_type, exc_value, exc_traceback, args, fatal)
+            return
+
+        deadline = clock() + self.captureBudget if self.captureBudget else None
+
+        message, complete = exception_message(exc_value, self.captureBudget)
+        occ = Occurrence.from_exception(exc_type, exc_value, exc_traceback, self.localsCapture, message, deadline)
+        if not complete:
+            occ.degrade('minimal')
+        if fatal:
+            occ.priority = FATAL_PRIORITY
+        if args:
+            occ.update(args)
+        self.record(occ, deadline)
+
+    def recordMemoryError(self, exc_type, exc_value, exc_traceback, args=None, fatal=False):
+        """
+        Record a `MemoryError` with as little memory as possible: the reserve set aside by `reserveMemory`
+        is freed first, and only a minimal occurrence is saved (see `Occurrence.degrade`), without local
+        variables but with the whole backtrace. If `tracemalloc` is tracing, the `memoryTraceTop` lines
+        holding the most memory are attached as `allocation_summary`. Used by `recordException` when
+        `memoryReserve` is set.
+        """
+        self._reserve = None
+        try:
+            message, complete = exception_message(exc_value)
+            occ = Occurrence.from_exception(exc_type, exc_value, exc_traceback, message=message)
+            # The backtrace entries are already allocated, so keeping all of them costs nothing more.
+            frames = occ.frames
+            occ.degrade('minimal')
+            occ.frames = frames
+            if fatal:
+                occ.priority = FATAL_PRIORITY
+            if args:
+                occ.update(args)
+            if self.memoryTraceTop:
+                try:
+                    summary = allocation_summary(self.memoryTraceTop)
+                except MemoryError:
+                    summary = None
+                if summary:
+                    occ.set('allocation_summary', summary)
+            self.record(occ)
+        except MemoryError:
+            log.warn("Out of memory while recording MemoryError")
+            return
+
+        if self.memoryReserve:
+            try:
+                self.reserveMemory()
+            except MemoryError:
+                pass  # Still short of memory; try again after the next one
+
+    def isIgnored(self, exc_type):
+        """
+        Return True if exceptions of class `exc_type` should not be reported (see `ignoredExceptions`).
+        """
+        return exc_type.__name__ in self.ignoredExceptions or exc_type in self.ignoredExceptions
 
     def excepthook(self, exc_type, exc_value, exc_traceback):
         """
@@ -270,10 +536,53 @@ class SquashClient(object):
         the exception class, exception instance, and a traceback object.
         """
 
-        self.recordException(exc_type, exc_value, exc_traceback)
+        self.recordException(exc_type, exc_value, exc_traceback, fatal=True,
+                             args={'thread_name': threading.current_thread().name, 'origin': 'excepthook'})
 
         self.old_excepthook(exc_type, exc_value, exc_traceback)
 
+    def threadExcepthook(self, hook_args):
+        """
+        From :func:`threading.excepthook`, installed by ``hook(threads=True)``. Queues the exception that
+        ended a thread, other than `SystemExit`, on `captureQueue`.
+        """
+        if hook_args.exc_type is not SystemExit and not self.disabled:
+            self.captureQueue.put(hook_args.exc_type, hook_args.exc_value, hook_args.exc_traceback, 'thread',
+                                  thread=hook_args.thread or threading.current_thread(), fatal=True)
+
+        self.old_threading_excepthook(hook_args)
+
+    def unraisablehook(self, unraisable):
+        """
+        From :func:`sys.unraisablehook`, installed by ``hook(unraisable=True)``. Queues the exception on
+        `captureQueue`, with the hook's message as `unraisable_message` and the name of the function or class
+        of the object it concerns as `unraisable_object`. The object itself isn't kept, since that could
+        resurrect it: once the previous hook has run, the local variables of the traceback's frames, such as
+        the `self` of a failed `__del__`, are cleared, so they aren't sent with `localsCapture`.
+        """
+        self.old_unraisablehook(unraisable)
+
+        if not self.disabled:
+            fields = {
+                'unraisable_message': unraisable.err_msg or "Exception ignored in",
+                'unraisable_object': describe_object(unraisable.object),
+            }
+            release_frames(unraisable.exc_traceback, unraisable.exc_value)
+            self.captureQueue.put(unraisable.exc_type, unraisable.exc_value, unraisable.exc_traceback,
+                                  'unraisable', fields=fields)
+
+    def watchFuture(self, future):
+        """
+        Record the exception raised by the callable behind a `concurrent.futures.Future` if nothing ever
+        retrieves it: it is queued on `captureQueue` when the future is garbage collected, unless its
+        `result` or `exception` was called (see `FutureWatch`). Returns `future`, so it can wrap a call
+        to `submit`::
+
+            client.watchFuture(executor.submit(work, item))
+        """
+        FutureWatch(self.captureQueue, future)
+        return future
+
     def recordSignal(self, sig_num, sig_frame):
         """
         Given the two values passed into a `signal` handler, record an occurence of the signal.
@@ -281,7 +590,7 @@ class SquashClient(object):
         if self.disabled:
             return
 
-        occ = Occurrence.from_signal(sig_num, sig_frame)
+        occ = Occurrence.from_signal(sig_num, sig_frame, self.localsCapture)
         self.record(occ)
 
     def sighandler(self, sig_num, sig_frame):
@@ -303,15 +612,11 @@ class SquashClient(object):
         # Reraise the signal
         os.kill(os.getpid(), sig_num)
 
-    def record(self, occ):
+    def filterString(self, message):
         """
-        Saves the given occurrence to a file. The file is placed within a subfolder of `self.occurrence_folder`
-        (by default "~/.SquashOccurrences") named with the app's API key.
+        Return `message` with each of `filterStrings` replaced by "[REDACTED]" and the user's home folder
+        replaced by "~".
         """
-        args = occ.args
-
-        message = args['message']
-
         # Remove filtered strings from exception message.
         for filter in self.filterStrings:
             message = message.replace(filter, '[REDACTED]')
@@ -321,9 +626,100 @@ class SquashClient(object):
         message = message.replace(os.path.expanduser('~'), '~')
         message = message.replace(repr(os.path.expanduser('~')), '~')
 
-        args['message'] = message
+        return message
+
+    def startWatchdog(self, threshold=5.0, watchMain=True):
+        """
+        Start a `StallWatchdog` that records an occurrence when the main thread (if `watchMain`) or a loop
+        passed to `watchLoop` makes no progress for `threshold` seconds. Returns the watchdog.
+        """
+        if self.watchdog is None:
+            self.watchdog = StallWatchdog(self, threshold, watchMain=watchMain)
+            self.watchdog.start()
+        return self.watchdog
+
+    def stopWatchdog(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+            self.watchdog = None
+
+    def watchLoop(self, loop):
+        """
+        Report stalls of the asyncio event `loop`, starting a watchdog that only watches loops if none
+        is running.
+        """
+        self.startWatchdog(watchMain=False).watch_loop(loop)
+
+    def installDumpSignal(self, signum=None):
+        """
+        Record the stacks of all threads whenever the process receives `signum` (by default `SIGUSR1`),
+        without otherwise affecting it. e.g. ``kill -USR1 <pid>`` to see what a hung process is doing.
+        """
+        if signum is None:
+            signum = signal.SIGUSR1
+        signal.signal(signum, self.dumphandler)
+
+    def dumphandler(self, sig_num, sig_frame):
+        """
+        Signal handler installed by `installDumpSignal`.
+        """
+        if self.disabled:
+            return
+        self.record(dump_occurrence("Stack Dump", "Stack dump requested by signal %d" % sig_num, sig_frame))
+
+    def startRaiseSampler(self, modules, flushInterval=60, samplesPerSecond=10, maxRaisesPerSecond=10000,
+                          maxOverhead=0.01):
+        """
+        Start a `RaiseSampler` that counts the exceptions raised in `modules` (module or package names), even
+        those caught and never reported, and records a summary of each every `flushInterval` seconds. It
+        turns itself off if its overhead goes above `maxOverhead` (a fraction of wall time), or more than
+        `maxRaisesPerSecond` exceptions are raised in a second. Raises RuntimeError before Python 3.12.
+        Returns the sampler.
+        """
+        if self.raiseSampler is None:
+            sampler = RaiseSampler(self, modules, flushInterval, samplesPerSecond, maxRaisesPerSecond, maxOverhead)
+            sampler.start()
+            self.raiseSampler = sampler
+        return self.raiseSampler
+
+    def stopRaiseSampler(self):
+        if self.raiseSampler is not None:
+            self.raiseSampler.stop()
+            self.raiseSampler = None
+
+    def timed(self, name=None, threshold=1.0, sampleRate=1.0, reportInterval=60):
+        """
+        Return a `SlowOperation` that records an occurrence when the code it wraps takes longer than `threshold`
+        seconds. Use it as a decorator or a context manager::
+
+            with client.timed("load config", threshold=0.5):
+                config = load_config()
+
+        Only `sampleRate` of slow runs are reported, and each operation at most every `reportInterval` seconds.
+        """
+        return SlowOperation(self, name, threshold, sampleRate, reportInterval)
+
+    def record(self, occ, deadline=None):
+        """
+        Saves the given occurrence to a file. The file is placed within a subfolder of `self.occurrence_folder`
+        (by default "~/.SquashOccurrences") named with the app's API key.
+
+        If `forwarderSocket` is set, the occurrence is first offered to the forwarder daemon listening there,
+        and only saved to a file if the daemon doesn't accept it.
+
+        If `captureBudget` is set, the occurrence is degraded (see `Occurrence.degrade`) as needed to finish
+        by `deadline`, a value of :func:`squash_python.occurrence.clock` that defaults to `captureBudget`
+        seconds from now.
+        """
+        if deadline is None and self.captureBudget:
+            deadline = clock() + self.captureBudget
+
+        occ.set('message', self.filterString(occ.get('message')))
+        for variables in occ.get('frame_locals') or ():
+            for name, value in variables.items():
+                variables[name] = self.filterString(value)
 
-        args.update({
+        occ.update({
             # Required fields
             'api_key':self.APIKey,
             'environment':self.environment,
@@ -331,54 +727,126 @@ class SquashClient(object):
             'client': "squash_python",
             'occurred_at': datetime.now().isoformat(),
             'revision': self.revision,
-
-            # Additional fields
-            'arguments': sys.argv,
-            'env_vars': dict(os.environ),
-            'pid': os.getpid(),
-
-            'device_id': hex(hash(platform.node())), # Hash of machine name - should be good ehough
-            'device_type': platform.processor(), # "Intel64 Family 6 Model 30 Stepping 5, GenuineIntel"
-            'operating_system': platform.system(), # "Windows"
-            'os_version': platform.release(), # "7"
-            'os_build': platform.version(), # "6.1.7601"
-
-            #'physical_memory': #needs platform code
-
-            'architecture': platform.machine(),
-            'process_path': sys.executable,
         })
 
         if self.version:
-            args['version'] = self.version
+            occ.set('version', self.version)
         if self.build:
-            args['build'] = self.build
+            occ.set('build', self.build)
 
-        args.update(self.args)
-        filename = os.path.join(self.get_occurrence_folder(), args['UUID'])
+        occ.add_shared(self.get_process_fields())
+        # Kept by minimal occurrences, like the required fields above.
+        occ.add_shared(self.args, minimal=True)
+
+        if deadline is not None:
+            data = self.dumpWithin(occ, deadline)
+        else:
+            data = occ.dump()
+
+        if self.forwarderSocket:
+            timeout = 1.0 if deadline is None else min(1.0, max(0.05, deadline - clock()))
+            if send_occurrence(self.forwarderSocket, self.host, self.notifyPath, data, timeout,
+                               self.forwarderUids, occ.priority):
+                log.debug("Handed occurrence %s to forwarder", occ.get('UUID'))
+                return
+
+        # The priority prefix lets `reportErrors` order occurrences without reading them.
+        filename = os.path.join(self.get_occurrence_folder(), "%d-%s" % (occ.priority, occ.get('UUID')))
         log.debug("Saving occurrence to %s", filename)
 
+        start = clock()
         with codecs.open(filename, "wb", encoding="utf-8") as f:
-            f.write(occ.dump())
+            f.write(data)
+        if data:
+            # Moving average of recent seconds per byte written, used by `dumpWithin` to predict how long
+            # a write takes. Averaging the cost rather than the speed lets one slow write count.
+            cost = (clock() - start) / len(data)
+            self._writeCost = cost if self._writeCost is None else 0.8 * self._writeCost + 0.2 * cost
+
+    max_full_message_length = 65536
 
-    def reportErrors(self):
+    def dumpWithin(self, occ, deadline):
+        """
+        Serialize `occ`, first degrading it as far as needed for the time spent so far plus the expected
+        time to save it to fit before `deadline`. Past half the budget the occurrence is trimmed, and past
+        the deadline it is reduced to a minimal record.
+        """
+        now = clock()
+        if now > deadline:
+            occ.degrade('minimal')
+        elif now > deadline - self.captureBudget / 2 or len(occ.message or '') > self.max_full_message_length:
+            occ.degrade('trimmed')
+
+        data = occ.dump()
+        while occ.level != capture_levels[-1] and self._writeCost and clock() + len(data) * self._writeCost > deadline:
+            level = occ.level
+            occ.degrade(capture_levels[capture_levels.index(level) + 1])
+            if occ.level == level:
+                break  # Occurrences built from a complete dictionary can't be degraded
+            data = occ.dump()
+        return data
+
+    _process_fields = None
+
+    def get_process_fields(self):
+        """
+        Return the fields describing this process and machine that `record` adds to every occurrence.
+        They are gathered once per process and shared by all occurrences, so `env_vars` is the
+        environment as it was when the first occurrence was recorded.
+        """
+        fields = self._process_fields
+        if fields is None or fields['pid'] != os.getpid():
+            fields = self._process_fields = {
+                # Additional fields
+                'arguments': sys.argv,
+                'script_dir': os.path.dirname(os.path.abspath(sys.argv[0])),
+                'env_vars': dict(os.environ),
+                'pid': os.getpid(),
+
+                'device_id': hex(hash(platform.node())), # Hash of machine name - should be good ehough
+                'device_type': platform.processor(), # "Intel64 Family 6 Model 30 Stepping 5, GenuineIntel"
+                'operating_system': platform.system(), # "Windows"
+                'os_version': platform.release(), # "7"
+                'os_build': platform.version(), # "6.1.7601"
+
+                #'physical_memory': #needs platform code
+
+                'architecture': platform.machine(),
+                'process_path': sys.executable,
+            }
+        return fields
+
+    def reportErrors(self, timeSlice=None):
         """
         Loads all saved occurrences from the folder, reports them, and deletes them one by one.
+
+        Signals are sent first, then uncaught exceptions, then handled ones, oldest first within each.
+        Sending is paced by `drainBytesPerSecond` and `drainRequestsPerSecond`, and stops after
+        `timeSlice` seconds (by default `drainTimeSlice`); the rest are sent by the next call.
         """
         if self.disabled:
             return
 
         occs = []
         folder = self.get_occurrence_folder()
-        uploader = SquashUploader(self.host, timeout=self.timeout)
+        uploader = SquashUploader(self.host, timeout=self.timeout, keepalive=True)
+        scheduler = DrainScheduler(folder, self.drainBytesPerSecond, self.drainRequestsPerSecond,
+                                   timeSlice if timeSlice is not None else self.drainTimeSlice)
+
+        if self.sourceContext:
+            source_cache = get_shared_cache()
+            source_cache.begin_batch()
+            revision = self.revision if self.revision is not NotImplemented else None
 
-        for filename in os.listdir(folder):
-            path = os.path.join(folder, filename)
+        for entry in scheduler:
+            filename = entry.name
+            path = entry.path
 
             try:
                 log.debug("Reporting occurrence from %s", filename)
-                with open(path, "rb") as f:
-                    args = json.loads(f.read().decode('utf-8'))
+                args = entry.load()
+                if self.sourceContext:
+                    add_source_context(args, source_cache, self.sourceContext, revision)
                 uploader.transmit(self.notifyPath, args)
 
             except urlerror.HTTPError as e:
@@ -392,7 +860,7 @@ class SquashClient(object):
                     log.warn("Data: \n%s\n", e.fp.read())
 
             except urlerror.URLError as e:
-                if hasattr(e.args[0], 'errno') and e.args[0].errno == 10061: # socket.error: No server running here
+                if getattr(e.args[0], 'errno', None) in (errno.ECONNREFUSED, 10061): # socket.error: No server running here
                     log.warn("No server responded at %s. Aborting.", self.host)
                     break
                 else:
@@ -403,6 +871,7 @@ class SquashClient(object):
 
             os.unlink(path)
 
+        uploader.close()
         return occs
 
     occurrence_folder = os.path.expanduser("~/.SquashOccurrences")
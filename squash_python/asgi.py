@@ -0,0 +1,50 @@
+"""
+    asgi
+
+ASGI middleware that reports exceptions escaping a request to Squash. Kept apart from
+:mod:`squash_python.middleware` because it needs Python 3.5 or later.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+from squash_python.middleware import _SquashMiddleware, clock
+
+
+class SquashASGIMiddleware(_SquashMiddleware):
+    """
+    Wraps an ASGI application and records an occurrence for any exception raised while handling an
+    HTTP or WebSocket connection, then re-raises the exception. The request method, URL parts, headers
+    and time spent are added to the occurrence.
+
+    Typical usage::
+
+        app = squash_python.SquashASGIMiddleware(app)
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] not in ('http', 'websocket'):
+            return await self.app(scope, receive, send)
+
+        start = clock()
+        try:
+            return await self.app(scope, receive, send)
+        except Exception:
+            self.record(sys.exc_info(), start, scope)
+            raise
+
+    def request_args(self, scope):
+        headers = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in scope.get('headers', ())]
+        server = scope.get('server') or (None, None)
+        query = scope.get('query_string', b'').decode('latin-1')
+
+        client = self.get_client()
+        return {
+            'request_method': scope.get('method', 'WEBSOCKET'),
+            'schema': scope.get('scheme'),
+            'host': server[0],
+            'port': server[1],
+            'path': client.filterString(scope.get('root_path', '') + scope.get('path', '')),
+            'query': client.filterString(query),
+            'headers': self.sanitize_headers(headers),
+        }
@@ -0,0 +1,151 @@
+"""
+    capture
+
+Hands exceptions caught away from the main thread to a background thread that records them: those
+raised in `threading.Thread` targets, stored in `concurrent.futures` results that are never retrieved,
+or raised where Python can't propagate them, such as in `__del__` (see :func:`sys.unraisablehook`).
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import atexit
+from collections import deque
+import sys
+import threading
+import time
+import traceback
+import types
+import weakref
+
+# The `FutureWatch` of every watched future that hasn't been garbage collected yet.
+_future_watches = set()
+
+
+def describe_object(obj):
+    """
+    Name `obj` without calling any of its methods: the qualified name of a function, such as the
+    `__del__` that raised, or else the name of its class.
+    """
+    if isinstance(obj, (types.FunctionType, types.MethodType)):
+        return getattr(obj, '__qualname__', obj.__name__)
+    return type(obj).__name__
+
+
+def release_frames(exc_traceback, exc_value=None):
+    """
+    Clear the local variables of the frames in `exc_traceback`, keeping the file, line and function of
+    each, so a queued exception doesn't keep other objects alive. The object an `AttributeError` was
+    raised on is dropped for the same reason.
+    """
+    if exc_traceback is not None:
+        traceback.clear_frames(exc_traceback)
+    if isinstance(exc_value, AttributeError) and getattr(exc_value, 'obj', None) is not None:
+        exc_value.obj = None
+
+
+class FutureWatch(object):
+    """
+    Puts the exception of a `concurrent.futures.Future` on `captureQueue` once the future is garbage
+    collected, unless its `result` or `exception` was called after it failed, as asyncio does for
+    tasks whose exception is never retrieved. The future's `result` and `exception` methods are
+    replaced on the instance to notice that.
+    """
+    __slots__ = ('captureQueue', 'future', 'exc_value', 'retrieved', '__weakref__')
+
+    def __init__(self, captureQueue, future):
+        self.captureQueue = captureQueue
+        self.future = weakref.ref(future, self._collected)
+        self.exc_value = None
+        self.retrieved = False
+        _future_watches.add(self)
+        # Only a weak reference to the future is held, so this doesn't keep it alive in a cycle.
+        cls = type(future)
+        watch = weakref.ref(self)
+
+        def result(timeout=None):
+            watch().retrieved = True
+            return cls.result(watch().future(), timeout)
+
+        def exception(timeout=None):
+            watch().retrieved = True
+            return cls.exception(watch().future(), timeout)
+
+        future.result = result
+        future.exception = exception
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        if not type(future).cancelled(future):
+            self.exc_value = type(future).exception(future)
+
+    def _collected(self, ref):
+        _future_watches.discard(self)
+        exc_value = self.exc_value
+        self.exc_value = None
+        if exc_value is not None and not self.retrieved:
+            self.captureQueue.put(type(exc_value), exc_value, getattr(exc_value, '__traceback__', None), 'future')
+
+
+class CaptureQueue(object):
+    """
+    Records exceptions through `client` on a background thread, so the thread they were caught on
+    takes no lock and does no I/O. `put` appends to a bounded queue (the oldest exception is dropped
+    when it is full), which is emptied every `flushInterval` seconds and when the interpreter exits.
+
+    Each occurrence is tagged with the name of the thread the exception was caught on as
+    `thread_name`, and how it was caught as `origin`.
+    """
+
+    def __init__(self, client, capacity=1000, flushInterval=0.5):
+        self.client = client
+        self.flushInterval = flushInterval
+        self._queue = deque(maxlen=capacity)
+        self._thread = None
+        self._startLock = threading.Lock()
+        self._closed = False
+
+    def put(self, exc_type, exc_value, exc_traceback, origin, thread=None, fields=None, fatal=False):
+        """
+        Queue an exception caught on `thread` (by default the current one) to be recorded, with the
+        extra `fields` if given. Occurrences with `fatal` set are sent before others by `reportErrors`.
+        """
+        if thread is None:
+            thread = threading.current_thread()
+        self._queue.append((exc_type, exc_value, exc_traceback, origin, thread.name, fields, fatal))
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._startLock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="SquashCapture")
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while not self._closed:
+            time.sleep(self.flushInterval)
+            self.flush()
+
+    def flush(self):
+        """
+        Record all queued exceptions.
+        """
+        client = self.client
+        while True:
+            try:
+                exc_type, exc_value, exc_traceback, origin, thread_name, fields, fatal = self._queue.popleft()
+            except IndexError:
+                break
+
+            args = {'thread_name': thread_name, 'origin': origin}
+            if fields:
+                args.update(fields)
+            try:
+                client.recordException(exc_type, exc_value, exc_traceback, args=args, fatal=fatal)
+            except Exception as e:
+                sys.stderr.write("SquashClient: %s while recording an exception from %s\n" % (e, thread_name))
+
+    def close(self):
+        self._closed = True
+        self.flush()
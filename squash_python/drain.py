@@ -0,0 +1,112 @@
+"""
+    drain
+
+Chooses the order and pace in which `SquashClient.reportErrors` sends saved occurrences.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import heapq
+import logging
+import os
+import time
+
+from squash_python.occurrence import HANDLED_PRIORITY, clock
+from squash_python.spool import SpoolEntry, iter_names
+
+log = logging.getLogger(__name__)
+
+
+def entry_priority(name):
+    """
+    Return the priority encoded in an occurrence file's name by `SquashClient.record` ("<priority>-<UUID>").
+    Files saved without one are treated as handled exceptions.
+    """
+    if len(name) > 2 and name[1] == '-' and name[0].isdigit():
+        return int(name[0])
+    return HANDLED_PRIORITY
+
+
+def entry_time(name):
+    """
+    Return the timestamp of the version 1 UUID in an occurrence file's name, in 100 ns units, so files
+    can be ordered by age without a `stat` call. Names that don't hold one give 0.
+    """
+    if len(name) > 2 and name[1] == '-' and name[0].isdigit():
+        name = name[2:]
+    # "tttttttt-tttt-1ttt-..." holds the low, middle and high parts of the timestamp.
+    if len(name) != 36 or name[14] != '1':
+        return 0
+    try:
+        return int(name[15:18] + name[9:13] + name[0:8], 16)
+    except ValueError:
+        return 0
+
+
+class DrainScheduler(object):
+    """
+    Iterates over the occurrences saved in `folder`, most urgent first: signals, then uncaught
+    exceptions, then handled ones, and oldest first within each. The order comes from the file names
+    alone. The folder is read in passes that each keep only the next `batchSize` names in memory (fewer
+    if `requestsPerSecond` and `timeSlice` allow fewer to be sent), and each pass resumes after the
+    last name yielded, so an occurrence saved during a drain with a more urgent name is left for the
+    next one.
+
+    Iteration is paced so that the occurrences yielded so far add up to no more than `bytesPerSecond`
+    bytes and `requestsPerSecond` occurrences per second (either may be None for no limit), and stops
+    once `timeSlice` seconds have passed. The size of an occurrence is known once the caller has loaded
+    it with `SpoolEntry.load`. Occurrences are only removed by the caller, so whatever is left is picked
+    up by the next drain, as are occurrences saved since this one started.
+    """
+
+    def __init__(self, folder, bytesPerSecond=None, requestsPerSecond=None, timeSlice=None, batchSize=5000):
+        self.folder = folder
+        self.bytesPerSecond = bytesPerSecond
+        self.requestsPerSecond = requestsPerSecond
+        self.timeSlice = timeSlice
+        self.batchSize = batchSize
+
+    def ordered_names(self):
+        """
+        Yield the names of the occurrence files in the order they should be sent.
+        """
+        limit = None
+        if self.requestsPerSecond and self.timeSlice is not None:
+            limit = int(self.requestsPerSecond * self.timeSlice) + 1
+        last = None
+        while limit is None or limit > 0:
+            size = self.batchSize if limit is None else min(self.batchSize, limit)
+            keys = ((entry_priority(name), entry_time(name), name) for name in iter_names(self.folder))
+            if last is not None:
+                keys = (key for key in keys if key > last)
+            batch = heapq.nsmallest(size, keys)
+            for key in batch:
+                yield key[2]
+            if len(batch) < size:
+                return
+            last = batch[-1]
+            if limit is not None:
+                limit -= size
+
+    def __iter__(self):
+        start = clock()
+        sent_bytes = 0
+        sent_requests = 0
+
+        for name in self.ordered_names():
+            wait = 0
+            if self.bytesPerSecond:
+                wait = max(wait, sent_bytes / self.bytesPerSecond)
+            if self.requestsPerSecond:
+                wait = max(wait, sent_requests / self.requestsPerSecond)
+            wait -= clock() - start
+
+            if self.timeSlice is not None and clock() + max(wait, 0) - start > self.timeSlice:
+                log.debug("Drain time slice of %ss used up", self.timeSlice)
+                return
+            if wait > 0:
+                time.sleep(wait)
+
+            entry = SpoolEntry(os.path.join(self.folder, name), name)
+            yield entry
+            sent_bytes += entry.size or 0
+            sent_requests += 1
@@ -0,0 +1,425 @@
+"""
+    forwarder
+
+A per-host daemon that uploads occurrences on behalf of every application process on the machine,
+and the client side of the local socket used to reach it.
+
+Applications set `SquashClient.forwarderSocket` to the daemon's socket path. `SquashClient.record`
+then hands each occurrence to the daemon, and only writes it to the occurrence folder if the daemon
+isn't running or doesn't accept it. The daemon queues occurrences in memory and sends them through a
+small pool of persistent connections per Squash server. Occurrences it fails to send, or still holds
+when it is stopped, are written to the occurrence folder, and the daemon sends them again every
+`retryInterval` seconds.
+
+Each occurrence travels over its own connection to the socket: a line of JSON holding the Squash host,
+the notify path and the occurrence's priority (see `squash_python.drain`), followed by the occurrence's
+arguments as serialized by `Occurrence.dump`. The daemon answers with one byte: "1" if the occurrence
+was queued, "0" if it was refused.
+
+Occurrences carry the environment and arguments of the process, so both ends check each other: the
+socket's default folder is private to the user, applications only send to a daemon running as
+themselves, root, or a user they trust, and the daemon only sends to the Squash servers and notify
+path it was started with.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+try:
+    import Queue as queue
+    import SocketServer as socketserver
+    import urllib2 as urlerror
+except ImportError:
+    import queue
+    import socketserver
+    import urllib.error as urlerror
+
+from squash_python.drain import DrainScheduler, entry_priority
+from squash_python.occurrence import HANDLED_PRIORITY
+from squash_python.spool import iter_folders, write_occurrence
+from squash_python.uploader import SquashUploader
+
+log = logging.getLogger(__name__)
+
+
+def _uid():
+    return os.getuid() if hasattr(os, 'getuid') else 0
+
+
+def default_socket_folder():
+    """
+    Return a folder only the current user can use: `$XDG_RUNTIME_DIR` if it is set, or else
+    "squash_forwarder-<uid>" in the system's temporary folder.
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    return os.path.join(tempfile.gettempdir(), "squash_forwarder-%d" % _uid())
+
+default_socket_path = os.path.join(default_socket_folder(), "squash_forwarder.sock")
+
+max_message_size = 16 * 1024 * 1024
+
+ACCEPTED = b"1"
+REFUSED = b"0"
+
+# Key added to the occurrences the daemon saves, holding the Squash server to send them to again.
+host_key = 'forwarder_host'
+
+
+def send_occurrence(socket_path, host, notifyPath, data, timeout=1.0, trusted_uids=(), priority=HANDLED_PRIORITY):
+    """
+    Hand the occurrence serialized as `data` to the forwarder listening on `socket_path`, to be saved
+    with `priority` if it can't be sent. Returns True if the forwarder accepted it, or False if it is
+    not running, refused it, or didn't answer within `timeout` seconds.
+
+    Nothing is sent unless the forwarder runs as the current user, root, or one of `trusted_uids`,
+    so another user can't collect occurrences by listening on the socket path first.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return False
+
+    header = json.dumps({'host': host, 'notifyPath': notifyPath, 'priority': priority})
+    data = (header + "\n" + data).encode('utf-8')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        peer_uid = _peer_uid(sock, socket_path)
+        if peer_uid not in (_uid(), 0) and peer_uid not in trusted_uids:
+            log.warn("Not sending to forwarder at %s: it is run by untrusted user %d", socket_path, peer_uid)
+            return False
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+        return sock.recv(1) == ACCEPTED
+    except (socket.error, socket.timeout) as e:
+        log.debug("Forwarder at %s unavailable: %s", socket_path, e)
+        return False
+    finally:
+        sock.close()
+
+
+def _peer_uid(sock, socket_path):
+    """
+    Return the user ID of the process listening on the other end of the connected `sock`, or where
+    the platform can't tell, of the owner of the socket file.
+    """
+    if hasattr(socket, 'SO_PEERCRED'):
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize(str('3i')))
+        pid, uid, gid = struct.unpack(str('3i'), creds)
+        return uid
+    return os.stat(socket_path).st_uid
+
+
+def _make_private_folder(folder):
+    if not os.path.isdir(folder):
+        os.makedirs(folder, 0o700)
+    st = os.stat(folder)
+    if st.st_uid != _uid() or st.st_mode & 0o077:
+        raise RuntimeError("%s must belong to this user and be accessible to no one else" % folder)
+
+
+class _ForwarderRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        chunks = []
+        size = 0
+        while True:
+            chunk = self.request.recv(65536)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_message_size:
+                log.warn("Refusing occurrence larger than %d bytes", max_message_size)
+                self.request.sendall(REFUSED)
+                return
+            chunks.append(chunk)
+
+        try:
+            header, data = b"".join(chunks).split(b"\n", 1)
+            envelope = json.loads(header.decode('utf-8'))
+            args = json.loads(data.decode('utf-8'))
+            accepted = self.server.forwarder.enqueue(envelope['host'], envelope['notifyPath'], args,
+                                                     int(envelope.get('priority', HANDLED_PRIORITY)))
+        except (ValueError, KeyError, TypeError) as e:
+            log.warn("Refusing malformed occurrence: %s", e)
+            accepted = False
+
+        self.request.sendall(ACCEPTED if accepted else REFUSED)
+
+
+class _ForwarderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _HostQueue(object):
+    """
+    The queue of occurrences for one Squash server, and the threads uploading them.
+    """
+    def __init__(self, forwarder, host):
+        self.forwarder = forwarder
+        self.host = host
+        self.queue = queue.Queue(forwarder.capacity)
+        self.threads = []
+        for i in range(forwarder.connections):
+            t = threading.Thread(target=self.run, name="SquashForwarder %s #%d" % (host, i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def run(self):
+        forwarder = self.forwarder
+        uploader = SquashUploader(self.host, timeout=forwarder.timeout, keepalive=True)
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    return
+                notifyPath, args, priority = item
+                try:
+                    uploader.transmit(notifyPath, args)
+                except urlerror.HTTPError as e:
+                    if e.code in (403, 422):
+                        log.warn("Error: %s from %s, dropping occurrence %s", e, self.host, args.get('UUID'))
+                    else:
+                        log.warn("Error: %s from %s, spooling occurrence %s", e, self.host, args.get('UUID'))
+                        forwarder.spool(args, priority, self.host)
+                except Exception as e:
+                    log.warn("%s while sending to %s, spooling occurrence %s", e, self.host, args.get('UUID'))
+                    forwarder.spool(args, priority, self.host)
+        finally:
+            uploader.close()
+
+    def stop(self):
+        """
+        Stop the upload threads, and spool whatever they didn't send.
+        """
+        pending = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            pending.append(item)
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join(self.forwarder.timeout or None)
+        for notifyPath, args, priority in pending:
+            self.forwarder.spool(args, priority, self.host)
+
+
+class SquashForwarder(object):
+    """
+    Accepts occurrences on a Unix domain socket and uploads them, through `connections` persistent
+    connections per Squash server. At most `capacity` occurrences are held per server; beyond that
+    they are refused, and the client saves them itself.
+
+    Only occurrences for one of `hosts` (such as "https://squash.example.com") and for `notifyPath`
+    are accepted, so processes that can reach the socket can't make the daemon send requests elsewhere.
+
+    Occurrences that couldn't be sent are saved in `occurrence_folder`, and every `retryInterval`
+    seconds, those saved there for one of `hosts` are queued again, most urgent first (see
+    `squash_python.drain`), until a queue is full.
+    """
+
+    def __init__(self, socket_path=default_socket_path, connections=2, capacity=10000, timeout=15,
+                 occurrence_folder=None, hosts=(), notifyPath="/api/1.0/notify", retryInterval=60):
+        if occurrence_folder is None:
+            import squash_python
+            occurrence_folder = squash_python.SquashClient.occurrence_folder
+        self.socket_path = socket_path
+        self.connections = connections
+        self.capacity = capacity
+        self.timeout = timeout
+        self.occurrence_folder = occurrence_folder
+        self.hosts = frozenset(host.rstrip('/') for host in hosts)
+        self.notifyPath = notifyPath
+        self.retryInterval = retryInterval
+        self._hosts = {}
+        self._hosts_lock = threading.Lock()
+        self._server = None
+        self._stop = threading.Event()
+        self._retry_thread = None
+
+    def enqueue(self, host, notifyPath, args, priority=HANDLED_PRIORITY):
+        """
+        Queue an occurrence for upload. Returns False if the queue for `host` is full, or `host` or
+        `notifyPath` isn't one the forwarder was configured for.
+        """
+        if host.rstrip('/') not in self.hosts or notifyPath != self.notifyPath:
+            log.warn("Refusing occurrence for %s%s: not a configured Squash server", host, notifyPath)
+            return False
+        host_queue = self._hosts.get(host)
+        if host_queue is None:
+            with self._hosts_lock:
+                host_queue = self._hosts.get(host)
+                if host_queue is None:
+                    host_queue = self._hosts[host] = _HostQueue(self, host)
+        try:
+            host_queue.queue.put_nowait((notifyPath, args, priority))
+            return True
+        except queue.Full:
+            return False
+
+    def spool(self, args, priority=HANDLED_PRIORITY, host=None):
+        """
+        Save an occurrence to the occurrence folder for its API key with `priority`, as `SquashClient.record`
+        would, to be sent to `host` by `resend`.
+        """
+        try:
+            if host is not None:
+                args[host_key] = host
+            folder = os.path.join(self.occurrence_folder, args['api_key'])
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            write_occurrence(folder, args, indent=1, priority=priority)
+        except Exception as e:
+            log.warn("%s while saving occurrence %s; it is lost", e, args.get('UUID'))
+
+    def resend(self):
+        """
+        Queue the occurrences saved in the occurrence folder again, and delete their files. Occurrences
+        saved for a server that isn't one of `hosts` are left, as are those saved without one unless
+        there is only one server. Stops once a server's queue is full.
+        """
+        default_host = next(iter(self.hosts)) if len(self.hosts) == 1 else None
+        count = 0
+        for folder in iter_folders(self.occurrence_folder):
+            for entry in DrainScheduler(folder):
+                try:
+                    args = entry.load()
+                except (IOError, OSError, ValueError) as e:
+                    log.debug("Unable to read %s: %s", entry.path, e)
+                    continue
+                host = args.pop(host_key, None) or default_host
+                if host is None or host.rstrip('/') not in self.hosts:
+                    continue
+                if not self.enqueue(host, self.notifyPath, args, entry_priority(entry.name)):
+                    log.info("Queue for %s is full; resending the rest later", host)
+                    return count
+                try:
+                    entry.delete()
+                except OSError:
+                    pass  # Already sent by another drain
+                count += 1
+        if count:
+            log.info("Queued %d saved occurrences again", count)
+        return count
+
+    def _run_retries(self):
+        while not self._stop.wait(self.retryInterval):
+            try:
+                self.resend()
+            except Exception as e:
+                log.warn("%s while resending saved occurrences", e)
+
+    def serve_forever(self, mode=None):
+        """
+        Listen on `socket_path` until `close` is called or the process is interrupted. If `mode` is
+        given, the socket's permissions are set to it so other users' processes can connect.
+        The default socket folder is created if needed, and must be private to the current user.
+        """
+        if self.socket_path == default_socket_path:
+            _make_private_folder(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            if _is_listening(self.socket_path):
+                raise RuntimeError("A forwarder is already listening on %s" % self.socket_path)
+            os.unlink(self.socket_path)
+
+        self._server = _ForwarderServer(self.socket_path, _ForwarderRequestHandler)
+        self._server.forwarder = self
+        if mode is not None:
+            os.chmod(self.socket_path, mode)
+        if self.retryInterval:
+            self._stop.clear()
+            self._retry_thread = threading.Thread(target=self._run_retries, name="SquashForwarder retries")
+            self._retry_thread.daemon = True
+            self._retry_thread.start()
+        log.info("Forwarding occurrences from %s", self.socket_path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop listening, and spool every occurrence that hasn't been sent.
+        """
+        self._stop.set()
+        if self._retry_thread is not None:
+            self._retry_thread.join()
+            self._retry_thread = None
+        if self._server is not None:
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        with self._hosts_lock:
+            hosts, self._hosts = self._hosts, {}
+        for host_queue in hosts.values():
+            host_queue.stop()
+
+
+def _is_listening(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def main():
+    argv = sys.argv
+    parser = argparse.ArgumentParser(description="Upload occurrences to Squash on behalf of every squash_python "
+                                                 "application on this host.")
+    parser.add_argument('-H', '--host', action='append', required=True, dest='hosts',
+                        help="A Squash server to send occurrences to, e.g. https://squash.example.com. Repeat "
+                             "for several; occurrences for other servers are refused")
+    parser.add_argument('--notify-path', default="/api/1.0/notify",
+                        help="API path to post occurrences to (default %(default)s)")
+    parser.add_argument('-s', '--socket', default=default_socket_path,
+                        help="Path of the Unix domain socket to listen on (default %(default)s)")
+    parser.add_argument('-m', '--mode', type=lambda s: int(s, 8),
+                        help="Octal permissions for the socket, e.g. 666 to accept occurrences from any user. "
+                             "The socket's folder must allow them too")
+    parser.add_argument('-c', '--connections', type=int, default=2,
+                        help="Persistent connections per Squash server (default %(default)s)")
+    parser.add_argument('-q', '--capacity', type=int, default=10000,
+                        help="Occurrences queued per Squash server before refusing more (default %(default)s)")
+    parser.add_argument('-t', '--timeout', type=int, default=15, help="HTTP connection timeout (default %(default)s)")
+    parser.add_argument('-d', '--folder', help="Folder to save unsent occurrences in (default ~/.SquashOccurrences)")
+    parser.add_argument('-r', '--retry-interval', type=float, default=60,
+                        help="Seconds between attempts to send saved occurrences again; 0 for never (default %(default)s)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log each upload")
+    parser.add_argument('-V', '--version', action='version', version="1.0.0")
+    args = parser.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    def terminate(sig_num, sig_frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, terminate)
+
+    forwarder = SquashForwarder(args.socket, connections=args.connections, capacity=args.capacity,
+                                timeout=args.timeout, occurrence_folder=args.folder, hosts=args.hosts,
+                                notifyPath=args.notify_path, retryInterval=args.retry_interval)
+    try:
+        forwarder.serve_forever(mode=args.mode)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
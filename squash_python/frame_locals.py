@@ -0,0 +1,167 @@
+"""
+    frame_locals
+
+Bounded capture of the local variables of the innermost frames of a backtrace.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import fnmatch
+from itertools import islice
+import time
+
+try:
+    _string_types = (str, unicode)
+except NameError:
+    _string_types = (str, bytes)
+
+try:
+    _integer_types = (int, long)
+except NameError:
+    _integer_types = (int,)
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+_scalar_types = (type(None), bool, float, complex) + _integer_types
+_container_types = (list, tuple, set, frozenset, dict)
+
+default_redacted_names = [
+    '*password*',
+    '*passwd*',
+    '*secret*',
+    '*token*',
+    '*apikey*',
+    '*api_key*',
+    '*auth*',
+    '*credential*',
+    '*cookie*',
+]
+
+
+class LocalsCapture(object):
+    """
+    Settings for capturing local variables, set as `SquashClient.localsCapture` to enable it.
+
+    The local variables of the innermost `frames` frames are converted to strings of at most
+    `reprLength` characters. Capture stops once the names and values add up to `byteBudget` characters
+    or `timeBudget` seconds have been spent, and the occurrence is marked as truncated.
+
+    Variables whose names match one of the :mod:`fnmatch` patterns in `redactedNames` (compared in
+    lowercase) are replaced by "[REDACTED]".
+
+    Only builtin scalars, strings and containers are converted with `repr`, element by element and
+    stopping at the length limit. Other objects are shown by class name unless `callRepr` is True, in
+    which case their own `__repr__` is called. That `__repr__` may be arbitrarily slow, so only
+    enable `callRepr` if you trust the objects on your stack.
+    """
+
+    def __init__(self, frames=5, reprLength=200, byteBudget=8192, timeBudget=0.01,
+                 redactedNames=None, callRepr=False):
+        self.frames = frames
+        self.reprLength = reprLength
+        self.byteBudget = byteBudget
+        self.timeBudget = timeBudget
+        self.redactedNames = default_redacted_names if redactedNames is None else redactedNames
+        self.callRepr = callRepr
+
+    def capture(self, frames, deadline=None):
+        """
+        Given frame objects, most recent call first, return a list with one dict of local variable
+        names to strings per captured frame, and a flag that is True if a budget ran out. If a
+        `deadline` (a value of `clock`) is given, capture also stops then.
+        """
+        deadline = min(clock() + self.timeBudget, deadline or float('inf'))
+        remaining = self.byteBudget
+        result = []
+        truncated = False
+
+        for frame in islice(frames, self.frames):
+            variables = {}
+            result.append(variables)
+            try:
+                # A <module> frame's locals are its live globals, which another thread may be changing.
+                items = list(frame.f_locals.items())
+            except RuntimeError:
+                truncated = True
+                continue
+            for name, value in items:
+                if remaining <= 0 or clock() > deadline:
+                    return result, True
+
+                if self.is_redacted(name):
+                    text = '[REDACTED]'
+                else:
+                    text = self.safe_repr(value, 2)
+                variables[name] = text
+                remaining -= len(name) + len(text)
+
+        return result, truncated
+
+    def is_redacted(self, name):
+        name = name.lower()
+        for pattern in self.redactedNames:
+            if fnmatch.fnmatchcase(name, pattern):
+                return True
+        return False
+
+    def safe_repr(self, value, depth):
+        """
+        Return a string for `value` of at most `reprLength` characters, without calling any
+        `__repr__` defined outside the builtin types unless `callRepr` is set.
+        """
+        limit = self.reprLength
+        cls = type(value)
+
+        try:
+            if cls in _scalar_types:
+                text = repr(value)
+            elif cls in _string_types:
+                text = repr(value[:limit])
+                if len(value) > limit:
+                    text += '...'
+            elif cls in _container_types:
+                text = self._container_repr(value, depth)
+            elif self.callRepr:
+                text = repr(value)
+            else:
+                text = '<%s.%s object>' % (cls.__module__, cls.__name__)
+        except Exception as e:
+            text = '<%s.%s object; repr raised %s>' % (cls.__module__, cls.__name__, type(e).__name__)
+
+        if len(text) > limit:
+            text = text[:limit] + '...'
+        return text
+
+    def _container_repr(self, value, depth):
+        cls = type(value)
+        if cls is dict:
+            opener, closer = '{', '}'
+        elif cls is list:
+            opener, closer = '[', ']'
+        elif cls is tuple:
+            opener, closer = '(', ')'
+        else:
+            opener, closer = cls.__name__ + '({', '})'
+
+        if not value:
+            return repr(value)
+        if depth <= 0:
+            return '%s...%s' % (opener, closer)
+
+        parts = []
+        length = 0
+        for item in islice(value.items() if cls is dict else value, self.reprLength // 2):
+            if cls is dict:
+                part = '%s: %s' % (self.safe_repr(item[0], depth - 1), self.safe_repr(item[1], depth - 1))
+            else:
+                part = self.safe_repr(item, depth - 1)
+            parts.append(part)
+            length += len(part) + 2
+            if length > self.reprLength:
+                break
+
+        if len(parts) < len(value):
+            parts.append('...')
+        return opener + ', '.join(parts) + closer
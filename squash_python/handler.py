@@ -0,0 +1,152 @@
+"""
+    handler
+
+A :class:`logging.Handler` that reports logged exceptions to Squash.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque
+import logging
+import os
+import sys
+import threading
+import time
+
+from squash_python.occurrence import Occurrence, get_frames
+
+log = logging.getLogger(__name__)
+
+# Frames in these files are skipped when capturing the stack of a record without exc_info.
+_srcfiles = tuple(os.path.normcase(os.path.splitext(f)[0]) for f in (logging.__file__, __file__))
+
+
+class SquashHandler(logging.Handler):
+    """
+    Records an occurrence for each log record that carries `exc_info`, such as those logged by
+    :meth:`logging.Logger.exception`. If `errorLevel` is set, records at or above that level are
+    recorded too, using the stack of the logging call as the backtrace.
+
+    Exceptions are recorded with `SquashClient.recordException`, like any other. The log message and
+    logger name are added to the occurrence as `log_message` and `logger_name`.
+
+    `emit` does not take a lock or touch the disk. Records are appended to a bounded queue (the oldest
+    is dropped when it is full) and saved by a background thread every `flushInterval` seconds.
+    Records from the same place with the same exception class are only recorded once every
+    `dedupInterval` seconds; the number of repeats skipped is sent with the next one as `repeat_count`.
+
+    Typical usage::
+
+        logging.getLogger().addHandler(squash_python.SquashHandler())
+    """
+
+    def __init__(self, client=None, level=logging.NOTSET, errorLevel=None, dedupInterval=60,
+                 capacity=10000, flushInterval=0.5):
+        """
+        :param client: The client to record with. By default, the shared client from `get_client`.
+        :param errorLevel: If not None, also record messages logged at this level or above without `exc_info`.
+        :param dedupInterval: Seconds during which repeats of a record are counted instead of recorded.
+        :param capacity: Maximum number of records waiting to be saved.
+        :param flushInterval: Seconds between saves by the background thread.
+        """
+        logging.Handler.__init__(self, level)
+        self.client = client
+        self.errorLevel = errorLevel
+        self.dedupInterval = dedupInterval
+        self.flushInterval = flushInterval
+        self._queue = deque(maxlen=capacity)
+        self._seen = {}
+        self._thread = None
+        self._startLock = threading.Lock()
+        self._closed = False
+
+    def handle(self, record):
+        # As `Handler.handle`, without taking the handler's lock around `emit`, which only appends to a deque.
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv  # Python 3.12 lets filters return a replacement record
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            if record.exc_info and record.exc_info[0] is not None:
+                exc_info = record.exc_info
+                frames = None
+            elif self.errorLevel is not None and record.levelno >= self.errorLevel:
+                exc_info = None
+                frames = list(get_frames(self._caller_frame()))
+            else:
+                return
+
+            key = (record.name, record.pathname, record.lineno, exc_info and exc_info[0])
+            now = time.time()
+            seen = self._seen.get(key)
+            if seen is not None and now - seen[0] < self.dedupInterval:
+                seen[1] += 1
+                return
+            repeats = seen[1] if seen is not None else 0
+            if len(self._seen) > 10000:
+                self._seen.clear()
+            self._seen[key] = [now, 0]
+
+            self._queue.append((record.getMessage(), record.name, record.levelname, exc_info, frames, repeats))
+
+            if self._thread is None:
+                self._start()
+        except Exception:
+            self.handleError(record)
+
+    def _caller_frame(self):
+        frame = sys._getframe(1)
+        while frame is not None and os.path.normcase(os.path.splitext(frame.f_code.co_filename)[0]) in _srcfiles:
+            frame = frame.f_back
+        return frame
+
+    def _start(self):
+        with self._startLock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="SquashHandler")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            time.sleep(self.flushInterval)
+            self.flush()
+
+    def flush(self):
+        """
+        Save all queued records as occurrences.
+        """
+        if self.client is None:
+            import squash_python
+            self.client = squash_python.get_client()
+        client = self.client
+
+        while True:
+            try:
+                message, name, levelname, exc_info, frames, repeats = self._queue.popleft()
+            except IndexError:
+                break
+
+            if client.disabled:
+                continue
+            try:
+                args = {'log_message': message, 'logger_name': name}
+                if repeats:
+                    args['repeat_count'] = repeats
+                if exc_info is not None:
+                    client.recordException(*exc_info, args=args)
+                else:
+                    occ = Occurrence.from_stack("Logged %s" % levelname, message, frames)
+                    occ.update(args)
+                    client.record(occ)
+            except Exception as e:
+                # Not logged through `log` at warning level, since that could feed back into this handler.
+                sys.stderr.write("SquashHandler: %s while recording a log message\n" % e)
+
+    def close(self):
+        self._closed = True
+        self.flush()
+        logging.Handler.close(self)
@@ -0,0 +1,151 @@
+"""
+    middleware
+
+WSGI middleware that reports exceptions escaping a request to Squash. The ASGI equivalent is in
+:mod:`squash_python.asgi`.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+sensitive_headers = frozenset([
+    'authorization',
+    'cookie',
+    'proxy-authorization',
+    'set-cookie',
+    'x-api-key',
+    'x-auth-token',
+    'x-csrftoken',
+])
+
+
+class _SquashMiddleware(object):
+    """
+    Common parts of the WSGI and ASGI middleware. Nothing here runs unless a request raises.
+    """
+
+    def __init__(self, app, client=None):
+        """
+        :param app: The application to wrap.
+        :param client: The client to record with. By default, the shared client from `get_client`.
+        """
+        self.app = app
+        self.client = client
+        self.sensitiveHeaders = sensitive_headers
+
+    def get_client(self):
+        if self.client is None:
+            import squash_python
+            self.client = squash_python.get_client()
+        return self.client
+
+    def sanitize_headers(self, headers):
+        """
+        Return a dict of the `(name, value)` pairs in `headers`. The values of headers named in
+        `sensitiveHeaders` are replaced by "[REDACTED]", and the rest are passed through the client's
+        `filterString`.
+        """
+        client = self.get_client()
+        result = {}
+        for name, value in headers:
+            if name.lower() in self.sensitiveHeaders:
+                result[name] = '[REDACTED]'
+            else:
+                result[name] = client.filterString(value)
+        return result
+
+    def record(self, exc_info, start, request):
+        """
+        Record the exception with the details of `request`, as returned by `request_args`. Failures are
+        logged rather than raised, so they never replace the application's exception.
+        """
+        elapsed = clock() - start
+        try:
+            request_args = self.request_args(request)
+            request_args['request_duration_ms'] = elapsed * 1000
+            self.get_client().recordException(*exc_info, args=request_args)
+        except Exception as e:
+            log.warn("%s while recording exception from request", e)
+
+
+class SquashWSGIMiddleware(_SquashMiddleware):
+    """
+    Wraps a WSGI application and records an occurrence for any exception raised by it, then re-raises
+    the exception. The request method, URL parts, headers and time spent are added to the occurrence.
+
+    Exceptions raised while the server iterates over the response body are only seen if
+    `captureStreaming` is True, as that requires wrapping every response.
+
+    Typical usage::
+
+        application = squash_python.SquashWSGIMiddleware(application)
+    """
+
+    def __init__(self, app, client=None, captureStreaming=False):
+        _SquashMiddleware.__init__(self, app, client)
+        self.captureStreaming = captureStreaming
+
+    def __call__(self, environ, start_response):
+        start = clock()
+        try:
+            result = self.app(environ, start_response)
+        except Exception:
+            self.record(sys.exc_info(), start, environ)
+            raise
+
+        if self.captureStreaming:
+            return _ResponseIterator(self, result, environ, start)
+        return result
+
+    def request_args(self, environ):
+        headers = []
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                headers.append((key[5:].replace('_', '-').title(), value))
+            elif key in ('CONTENT_TYPE', 'CONTENT_LENGTH') and value:
+                headers.append((key.replace('_', '-').title(), value))
+
+        client = self.get_client()
+        return {
+            'request_method': environ.get('REQUEST_METHOD'),
+            'schema': environ.get('wsgi.url_scheme'),
+            'host': environ.get('HTTP_HOST') or environ.get('SERVER_NAME'),
+            'port': environ.get('SERVER_PORT'),
+            'path': client.filterString(environ.get('SCRIPT_NAME', '') + environ.get('PATH_INFO', '')),
+            'query': client.filterString(environ.get('QUERY_STRING', '')),
+            'headers': self.sanitize_headers(headers),
+        }
+
+
+class _ResponseIterator(object):
+    """
+    Iterates over a WSGI response, recording any exception raised while doing so.
+    """
+
+    def __init__(self, middleware, result, environ, start):
+        self.middleware = middleware
+        self.result = result
+        self.environ = environ
+        self.start = start
+
+    def __iter__(self):
+        try:
+            for chunk in self.result:
+                yield chunk
+        except Exception:
+            self.middleware.record(sys.exc_info(), self.start, self.environ)
+            raise
+
+    def close(self):
+        close = getattr(self.result, 'close', None)
+        if close is not None:
+            close()
@@ -2,12 +2,34 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import json
 import logging
 import os
-from traceback import extract_tb
 import sys
 import signal
+import threading
+import time
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 log = logging.getLogger(__name__)
 
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+# From most to least detailed. See `Occurrence.degrade`.
+capture_levels = ('full', 'trimmed', 'minimal')
+
+# Order in which saved occurrences are sent; lower first. See `squash_python.drain`.
+SIGNAL_PRIORITY = 0
+FATAL_PRIORITY = 1
+HANDLED_PRIORITY = 2
+
+trimmed_frames = 30
+trimmed_message_length = 1000
+minimal_message_length = 200
+
 
 def relpath(path):
     """ If possible, transform path by making it relative to the folder containing the starting script """
@@ -17,17 +39,27 @@ def relpath(path):
         return os.path.relpath(path, dirname)
     return path
 
-def get_exc_backtrace(exc_traceback):
+def get_tb_entries(exc_traceback):
     """
-    Transform the python traceback object into a list of dicts in the format
+    Return a `(filename, lineno, name)` tuple for each entry of a traceback, most recent call first.
+    Unlike :func:`traceback.extract_tb`, this doesn't read the source lines.
+    """
+    entries = []
+    while exc_traceback is not None:
+        co = exc_traceback.tb_frame.f_code
+        entries.append((co.co_filename, exc_traceback.tb_lineno, co.co_name))
+        exc_traceback = exc_traceback.tb_next
+    entries.reverse()
+    return entries
+
+def make_backtrace(entries):
+    """
+    Transform `(filename, lineno, name)` tuples into a list of dicts in the format
     expected by the notify API. This adjusts any absolute paths in the filenames
     into paths relative to the folder containing the starting script (argv[0])
-
-    Python tracebacks have the most recent call last, but Squash expects it to be
-    first so we reverse the traceback.
     """
     backtrace = []
-    for filename, lineno, name, line in reversed(extract_tb(exc_traceback)):
+    for filename, lineno, name in entries:
         backtrace.append({
             "file":relpath(filename),
             "line":lineno,
@@ -36,6 +68,16 @@ def get_exc_backtrace(exc_traceback):
 
     return backtrace
 
+def get_exc_backtrace(exc_traceback):
+    """
+    Transform the python traceback object into a list of dicts in the format
+    expected by the notify API.
+
+    Python tracebacks have the most recent call last, but Squash expects it to be
+    first so we reverse the traceback.
+    """
+    return make_backtrace(get_tb_entries(exc_traceback))
+
 def get_frames(sig_frame, limit=None):
     n = 0
 
@@ -49,16 +91,7 @@ def get_frames(sig_frame, limit=None):
         n = n+1
 
 def get_signal_backtrace(sig_frame):
-    backtrace = []
-    for filename, lineno, name in get_frames(sig_frame):
-        backtrace.append({
-            "file":relpath(filename),
-            "line":lineno,
-            "symbol":name,
-
-        })
-
-    return backtrace
+    return make_backtrace(get_frames(sig_frame))
 
 signal_names = {
     signal.SIGABRT:"SIGABRT (Aborted)",
@@ -73,41 +106,271 @@ if sys.platform != "win32":
         signal.SIGTRAP:"SIGTRAP (Debugger Trap)",
     })
 
+def get_tb_frames(exc_traceback):
+    """
+    Return the frame objects of a traceback, most recent call first.
+    """
+    frames = []
+    while exc_traceback is not None:
+        frames.append(exc_traceback.tb_frame)
+        exc_traceback = exc_traceback.tb_next
+    frames.reverse()
+    return frames
+
+def get_stack_frames(sig_frame, limit):
+    frames = []
+    while sig_frame is not None and len(frames) < limit:
+        frames.append(sig_frame)
+        sig_frame = sig_frame.f_back
+    return frames
+
+def exception_message(exc_value, timeout=None):
+    """
+    Return `(message, complete)` for an exception. If the exception's class defines its own `__str__`,
+    or its arguments aren't plain strings or numbers, `str` is called on a separate thread and given
+    `timeout` seconds to finish; if it doesn't, or raises, a placeholder message is returned with
+    `complete` False. The placeholder is also used when no thread can be started.
+    """
+    cls = type(exc_value)
+    if timeout is None or not _may_be_slow(exc_value):
+        try:
+            return str(exc_value), True
+        except Exception:
+            return "<unprintable %s object>" % cls.__name__, False
+
+    result = []
+
+    def run():
+        try:
+            result.append(str(exc_value))
+        except Exception:
+            pass
+
+    t = threading.Thread(target=run, name="SquashClient str()")
+    t.daemon = True
+    try:
+        t.start()
+    except RuntimeError:
+        # No new threads at interpreter shutdown, e.g. when `CaptureQueue` flushes from `atexit`.
+        return "<str() of %s object not called at shutdown>" % cls.__name__, False
+    t.join(timeout)
+    if result:
+        return result[0], True
+    if t.is_alive():
+        return "<str() of %s object took longer than %ss>" % (cls.__name__, timeout), False
+    return "<unprintable %s object>" % cls.__name__, False
+
+def allocation_summary(limit=10):
+    """
+    Return the `limit` source lines holding the most memory, as dicts with `file`, `line`, `size` (bytes)
+    and `count` (blocks), or None if `tracemalloc` isn't tracing. Taking the snapshot copies every
+    trace, so this needs some free memory itself.
+    """
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot()
+    top = snapshot.statistics('lineno')[:limit]
+    del snapshot
+    summary = []
+    for stat in top:
+        frame = stat.traceback[0]
+        summary.append({'file': relpath(frame.filename), 'line': frame.lineno, 'size': stat.size, 'count': stat.count})
+    return summary
+
+_plain_types = (str, int, float, bool, type(None), type(b''), type(''))
+
+def _may_be_slow(exc_value):
+    # Methods of builtin types are slot wrappers with __objclass__; Python functions don't have it.
+    if not hasattr(type(exc_value).__str__, '__objclass__'):
+        return True
+    return not all(isinstance(arg, _plain_types) for arg in getattr(exc_value, 'args', ()))
+
 class Occurrence(object):
+    """
+    A recorded exception or signal.
+
+    Occurrences are kept compact until they are serialized: the backtrace is held as a tuple of
+    `(filename, lineno, name)` tuples whose strings are shared with the code objects, fields set on
+    the occurrence go in the small `fields` dict, and fields that are the same for every occurrence
+    (such as the platform details added by `SquashClient.record`) are dicts in `shared`, held by
+    reference. The dictionary sent to Squash is only built by `to_dict`, `dump`, or by reading `args`.
+    """
+    __slots__ = ('class_name', 'message', 'frames', 'threads', 'level', 'priority', 'fields', 'shared', '_args')
 
     @classmethod
-    def from_exception(cls, exc_type, exc_value, exc_traceback):
-        args = {
-            'message': str(exc_value),
-            'class_name': exc_type.__name__,
-            'backtraces': [{
-                "name": "Crashed Thread",
-                "faulted": True,
-                "backtrace": get_exc_backtrace(exc_traceback),
-            }],
-        }
-        return cls(args)
+    def from_exception(cls, exc_type, exc_value, exc_traceback, localsCapture=None, message=None, deadline=None):
+        """
+        :param localsCapture: If given, a `LocalsCapture` used to add the local variables of the innermost
+                              frames to the occurrence.
+        :param message: The exception's message, if already known. By default, `str(exc_value)`.
+        :param deadline: A value of `clock` after which local variables are no longer captured.
+        """
+        if message is None:
+            message = str(exc_value)
+        occ = cls.from_stack(exc_type.__name__, message, get_tb_entries(exc_traceback))
+        if localsCapture is not None:
+            occ.add_locals(localsCapture, get_tb_frames(exc_traceback), deadline)
+        return occ
 
     @classmethod
-    def from_signal(cls, sig_num, sig_frame):
+    def from_signal(cls, sig_num, sig_frame, localsCapture=None):
         message = signal_names.get(sig_num, "Signal %d" % sig_num)
+        occ = cls.from_stack(message, message, get_frames(sig_frame))
+        occ.priority = SIGNAL_PRIORITY
+        if localsCapture is not None:
+            occ.add_locals(localsCapture, get_stack_frames(sig_frame, localsCapture.frames))
+        return occ
+
+    @classmethod
+    def from_stack(cls, class_name, message, frames):
+        """
+        Build an occurrence that isn't tied to an exception or signal, from a list of
+        `(filename, lineno, name)` tuples as yielded by `get_frames`, most recent call first.
+        """
+        occ = cls()
+        occ.class_name = class_name
+        occ.message = message
+        occ.frames = tuple(frames)
+        return occ
+
+    def add_thread(self, name, frames):
+        """
+        Add the backtrace of another thread, given as `(filename, lineno, name)` tuples, most recent
+        call first. It is sent after the crashed thread's backtrace and isn't marked as faulted.
+        """
+        self.threads += ((name, tuple(frames)),)
+
+    def __init__(self, args=None):
+        """
+        :param args: The complete arguments of an occurrence, e.g. as loaded from a file. If given,
+                     the occurrence holds this dictionary instead of its compact fields.
+        """
+        self.class_name = None
+        self.message = None
+        self.frames = ()
+        self.threads = ()
+        self.level = 'full'
+        self.priority = HANDLED_PRIORITY
+        self.fields = None
+        self.shared = ()
+        self._args = args
+
+    @property
+    def args(self):
+        """
+        The arguments as sent to Squash. Reading this builds and keeps the full dictionary, and later
+        changes go to it; use `get`, `set` and `update` to keep the occurrence compact.
+        """
+        if self._args is None:
+            self._args = self.to_dict()
+        return self._args
+
+    def get(self, key, default=None):
+        if self._args is not None:
+            return self._args.get(key, default)
+        for shared, minimal in reversed(self.shared):
+            if key in shared:
+                return shared[key]
+        if self.fields is not None and key in self.fields:
+            return self.fields[key]
+        if key == 'message':
+            return self.message
+        if key == 'class_name':
+            return self.class_name
+        return default
+
+    def set(self, key, value):
+        if self._args is not None:
+            self._args[key] = value
+        elif key == 'message':
+            self.message = value
+        elif key == 'class_name':
+            self.class_name = value
+        else:
+            if self.fields is None:
+                self.fields = {}
+            self.fields[key] = value
+
+    def update(self, values):
+        for key, value in values.items():
+            self.set(key, value)
+
+    def add_shared(self, values, minimal=False):
+        """
+        Add a dict of fields that may be shared with other occurrences. It is referenced, not copied,
+        so it must not be changed afterwards. Unless `minimal` is True, the fields are dropped from a
+        minimal occurrence.
+        """
+        if self._args is not None:
+            self._args.update(values)
+        elif minimal or self.level != 'minimal':
+            self.shared += ((values, minimal),)
+
+    def degrade(self, level):
+        """
+        Reduce the occurrence to one of `capture_levels`, to make it cheaper to serialize and save.
+        'trimmed' drops local variables and keeps only the innermost frames and the start of the
+        message. 'minimal' keeps only the class name, the start of the message and the innermost frame,
+        plus the fields set on the occurrence itself and shared fields added with `minimal`; other shared
+        fields, such as the platform details, are dropped. The level is sent as `capture_level`. Occurrences built from a
+        complete `args` dictionary are left as they are.
+        """
+        if self._args is not None or capture_levels.index(level) <= capture_levels.index(self.level):
+            return
+        self.level = level
+        if self.fields is not None:
+            self.fields.pop('frame_locals', None)
+            self.fields.pop('frame_locals_truncated', None)
+        if level == 'trimmed':
+            self.message = self.message[:trimmed_message_length]
+            self.frames = self.frames[:trimmed_frames]
+            self.threads = tuple((name, frames[:trimmed_frames]) for name, frames in self.threads)
+        else:
+            self.message = self.message[:minimal_message_length]
+            self.frames = self.frames[:1]
+            self.threads = ()
+            self.shared = tuple(item for item in self.shared if item[1])
+
+    def to_dict(self):
+        """
+        Return the arguments as sent to Squash. Fields in `shared` override those in `fields`, and
+        later dicts in `shared` override earlier ones.
+        """
+        if self._args is not None:
+            return self._args
+
         args = {
-            'message': message,
-            'class_name': message,
+            'message': self.message,
+            'class_name': self.class_name,
             'backtraces': [{
                 "name": "Crashed Thread",
                 "faulted": True,
-                "backtrace": get_signal_backtrace(sig_frame),
+                "backtrace": make_backtrace(self.frames),
             }],
+            'capture_level': self.level,
         }
-        return cls(args)
+        for name, frames in self.threads:
+            args['backtraces'].append({
+                "name": name,
+                "faulted": False,
+                "backtrace": make_backtrace(frames),
+            })
+        if self.fields is not None:
+            args.update(self.fields)
+        for shared, minimal in self.shared:
+            args.update(shared)
+        return args
 
-    def __init__(self, args):
-        self.args = args
+    def add_locals(self, localsCapture, frames, deadline=None):
+        """
+        Add the local variables of `frames` (most recent call first) as `frame_locals`, a list matching
+        the start of the crashed thread's backtrace. `frame_locals_truncated` is set if a budget ran out.
+        """
+        frame_locals, truncated = localsCapture.capture(frames, deadline)
+        self.set('frame_locals', frame_locals)
+        if truncated:
+            self.set('frame_locals_truncated', True)
 
     def dump(self):
-        return json.dumps(self.args, indent=1)
-
-
-
-
+        # Minimal occurrences may be recorded with little memory to spare, so skip the indentation.
+        return json.dumps(self.to_dict(), indent=None if self.level == 'minimal' else 1)
@@ -0,0 +1,247 @@
+"""
+    raise_sampler
+
+Counts the exceptions raised in chosen modules, including those caught and swallowed before they
+could reach `SquashClient.recordException`, and periodically records a summary of each as an
+occurrence. Built on :mod:`sys.monitoring`, so it needs Python 3.12 or later.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import logging
+import sys
+import threading
+
+from squash_python.occurrence import Occurrence, _may_be_slow, clock, get_frames, minimal_message_length
+
+log = logging.getLogger(__name__)
+
+# Raised as part of normal control flow, so never counted.
+try:
+    control_flow_exceptions = frozenset([StopIteration, StopAsyncIteration, GeneratorExit])
+except NameError:  # Python 2
+    control_flow_exceptions = frozenset([StopIteration, GeneratorExit])
+
+# `sys.monitoring` tool IDs that aren't reserved for debuggers, coverage, profilers or optimizers.
+_tool_ids = (3, 4)
+
+
+def _offset_line(code, offset):
+    for start, end, line in code.co_lines():
+        if start <= offset < end and line is not None:
+            return line
+    return code.co_firstlineno
+
+
+class RaiseSampler(object):
+    """
+    Counts the exceptions raised by code in `modules` (module or package names), using the
+    :data:`sys.monitoring.events.RAISE` event, and every `flushInterval` seconds records one occurrence
+    per exception class and raising location, with the number of raises as `raise_count`.
+
+    The first raise from each location in an interval has its stack captured, up to `samplesPerSecond`
+    of them across all locations; the rest are only counted, in a dictionary holding at most
+    `maxFingerprints` locations. Counts from several threads may be slightly low. Exceptions used for
+    control flow, such as `StopIteration`, and those the client ignores are neither sampled nor counted.
+
+    The time spent handling raise events is estimated every second and kept in `overhead`, as a
+    fraction of wall time. Monitoring is turned off for good, with the reason in `disabledReason`, if
+    it is above `maxOverhead` or more than `maxRaisesPerSecond` exceptions are raised in a second.
+    """
+
+    def __init__(self, client, modules, flushInterval=60, samplesPerSecond=10, maxRaisesPerSecond=10000,
+                 maxOverhead=0.01, maxFingerprints=1000, frames=30):
+        self.client = client
+        self.modules = tuple(modules)
+        self.flushInterval = flushInterval
+        self.samplesPerSecond = samplesPerSecond
+        self.maxRaisesPerSecond = maxRaisesPerSecond
+        self.maxOverhead = maxOverhead
+        self.maxFingerprints = maxFingerprints
+        self.frames = frames
+        self.overhead = 0.0
+        self.disabledReason = None
+        self._tool = None
+        self._matches = {}
+        self._skipped = {}
+        self._counts = {}
+        self._overflow = 0
+        self._events = 0
+        self._sampleTime = 0.0
+        self._tokens = samplesPerSecond
+        self._eventCost = 0.0
+        self._lastFlush = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start monitoring. Raises RuntimeError before Python 3.12, or if no monitoring tool ID is free.
+        """
+        monitoring = getattr(sys, 'monitoring', None)
+        if monitoring is None:
+            raise RuntimeError("RaiseSampler needs sys.monitoring, from Python 3.12")
+        for tool in _tool_ids:
+            if monitoring.get_tool(tool) is None:
+                break
+        else:
+            raise RuntimeError("No sys.monitoring tool ID is free for RaiseSampler")
+
+        monitoring.use_tool_id(tool, "squash_python")
+        self._tool = tool
+        self._calibrate()
+        self._lastFlush = clock()
+        monitoring.register_callback(tool, monitoring.events.RAISE, self._on_raise)
+        monitoring.set_events(tool, monitoring.events.RAISE)
+
+        self._thread = threading.Thread(target=self.run, name="SquashRaiseSampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop monitoring, and record what has been counted since the last flush.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._release()
+        self.flush()
+
+    def _calibrate(self, n=1000):
+        # The cost of an event that isn't sampled, used to estimate the overhead from the number of events.
+        code = self._calibrate.__code__
+        exception = ValueError()
+        self._matches[code] = False
+        start = clock()
+        for i in range(n):
+            self._on_raise(code, 0, exception)
+        self._eventCost = (clock() - start) / n
+        self._events = 0
+
+    def _on_raise(self, code, instruction_offset, exception):
+        # Called for every exception raised in the process, so keep the common paths short.
+        self._events += 1
+        matched = self._matches.get(code)
+        if matched is None:
+            matched = self._match(code)
+        if not matched:
+            return
+        exc_type = type(exception)
+        skipped = self._skipped.get(exc_type)
+        if skipped is None:
+            skipped = self._skip(exc_type)
+        if skipped:
+            return
+        key = (exc_type, code, instruction_offset)
+        entry = self._counts.get(key)
+        if entry is not None:
+            entry[0] += 1
+        else:
+            self._add(key, exception)
+
+    def _match(self, code):
+        name = sys._getframe(2).f_globals.get('__name__') or ''
+        matched = any(name == module or name.startswith(module + '.') for module in self.modules)
+        if len(self._matches) > 10000:
+            self._matches.clear()
+        self._matches[code] = matched
+        return matched
+
+    def _skip(self, exc_type):
+        # Remembered until the next flush, so changes to the client's ignored exceptions apply from then.
+        skipped = exc_type in control_flow_exceptions or self.client.isIgnored(exc_type)
+        self._skipped[exc_type] = skipped
+        return skipped
+
+    def _add(self, key, exception):
+        counts = self._counts
+        if len(counts) >= self.maxFingerprints:
+            self._overflow += 1
+            return
+        sample = None
+        if self._tokens > 0:
+            self._tokens -= 1
+            start = clock()
+            frames = list(get_frames(sys._getframe(2), self.frames))
+            message = None if _may_be_slow(exception) else str(exception)[:minimal_message_length]
+            sample = (message, frames)
+            self._sampleTime += clock() - start
+        counts[key] = [1, sample]
+
+    def run(self):
+        last = clock()
+        last_events = 0
+        last_sample_time = 0.0
+        while not self._stop.wait(1.0):
+            now = clock()
+            events = self._events
+            sample_time = self._sampleTime
+            rate = (events - last_events) / (now - last)
+            self.overhead = ((events - last_events) * self._eventCost + sample_time - last_sample_time) / (now - last)
+            last, last_events, last_sample_time = now, events, sample_time
+            self._tokens = self.samplesPerSecond
+
+            if rate > self.maxRaisesPerSecond:
+                self.disable("%d exceptions raised per second" % rate)
+            elif self.overhead > self.maxOverhead:
+                self.disable("overhead of %.2f%%" % (100 * self.overhead))
+
+            if self.disabledReason is not None:
+                self.flush()
+                return
+            if now - self._lastFlush >= self.flushInterval:
+                self.flush()
+
+    def disable(self, reason):
+        """
+        Stop monitoring, recording `reason` in `disabledReason`. Counts so far are still flushed.
+        """
+        self.disabledReason = reason
+        log.warn("Raise sampler turned off: %s", reason)
+        self._release()
+
+    def _release(self):
+        if self._tool is not None:
+            monitoring = sys.monitoring
+            monitoring.set_events(self._tool, 0)
+            monitoring.register_callback(self._tool, monitoring.events.RAISE, None)
+            monitoring.free_tool_id(self._tool)
+            self._tool = None
+
+    def flush(self):
+        """
+        Record an occurrence for each exception class and location counted since the last flush.
+        """
+        now = clock()
+        interval = now - self._lastFlush
+        self._lastFlush = now
+        counts, self._counts = self._counts, {}
+        self._skipped = {}
+        overflow, self._overflow = self._overflow, 0
+        if overflow:
+            log.warn("%d raises from new locations weren't counted: more than %d locations", overflow,
+                     self.maxFingerprints)
+
+        client = self.client
+        if client.disabled:
+            return
+        for (exc_type, code, offset), (count, sample) in counts.items():
+            if sample is not None:
+                message, frames = sample
+            else:
+                message, frames = None, [(code.co_filename, _offset_line(code, offset), code.co_name)]
+            try:
+                occ = Occurrence.from_stack(exc_type.__name__, "Raised %d times in %d seconds" % (count, interval),
+                                            frames)
+                occ.update({
+                    'origin': 'raise_sampler',
+                    'raise_count': count,
+                    'sample_interval': interval,
+                    'sampler_overhead': self.overhead,
+                })
+                if message is not None:
+                    occ.set('sampled_message', client.filterString(message))
+                client.record(occ)
+            except Exception as e:
+                log.warn("%s while recording raise summary for %s", e, exc_type.__name__)
@@ -0,0 +1,109 @@
+"""
+    revision
+
+Determine the Git revision checked out in a project directory without starting a subprocess.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import io
+import logging
+import os
+import re
+import subprocess
+
+log = logging.getLogger(__name__)
+
+_sha_re = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+def find_git_dir(project_dir):
+    """
+    Return the Git directory for the repository containing `project_dir`, searching parent folders
+    as `git` does. Follows the "gitdir:" indirection used by worktrees and submodules. Returns None
+    if no repository is found.
+    """
+    path = os.path.abspath(project_dir)
+    while True:
+        candidate = os.path.join(path, ".git")
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            content = _read(candidate)
+            if content.startswith("gitdir:"):
+                return os.path.normpath(os.path.join(path, content[len("gitdir:"):].strip()))
+            return None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def read_head_revision(git_dir):
+    """
+    Resolve HEAD in `git_dir` to a commit ID by reading HEAD, loose refs, and packed-refs directly.
+    Returns None if HEAD can't be resolved this way (e.g. an unborn branch or an unusual ref storage).
+    """
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir_file):
+        common_dir = os.path.normpath(os.path.join(git_dir, _read(commondir_file).strip()))
+
+    head = _read(os.path.join(git_dir, "HEAD")).strip()
+
+    # Follow symbolic refs; bounded in case of a ref loop.
+    for _ in range(10):
+        if not head.startswith("ref:"):
+            break
+        ref = head[len("ref:"):].strip()
+        head = _read_ref(git_dir, common_dir, ref)
+        if head is None:
+            return None
+
+    if _sha_re.match(head):
+        return head
+    return None
+
+
+def _read_ref(git_dir, common_dir, ref):
+    for folder in (git_dir, common_dir):
+        path = os.path.join(folder, *ref.split("/"))
+        if os.path.isfile(path):
+            return _read(path).strip()
+
+    packed_refs = os.path.join(common_dir, "packed-refs")
+    if os.path.isfile(packed_refs):
+        with io.open(packed_refs, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("#") or line.startswith("^"):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def _read(path):
+    with io.open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def get_revision(project_dir=None):
+    """
+    Return the commit ID checked out in `project_dir` (default current directory). Reads the
+    repository's files directly, and falls back to running `git rev-parse HEAD` if that fails.
+    Raises `subprocess.CalledProcessError` or `OSError` if neither method works.
+    """
+    if project_dir is None:
+        project_dir = os.getcwd()
+
+    try:
+        git_dir = find_git_dir(project_dir)
+        if git_dir is not None:
+            revision = read_head_revision(git_dir)
+            if revision is not None:
+                return revision
+    except (IOError, OSError, UnicodeDecodeError) as e:
+        log.debug("Unable to read revision from %s: %s", project_dir, e)
+
+    log.debug("Falling back to `git rev-parse HEAD` in %s", project_dir)
+    return subprocess.check_output("git rev-parse HEAD".split(), cwd=project_dir).strip().decode('ascii')
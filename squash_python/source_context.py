@@ -0,0 +1,140 @@
+"""
+    source_context
+
+Adds lines of source code around each frame of an occurrence's backtrace. This is done when
+occurrences are sent, not when they are recorded, so recording never reads source files.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import OrderedDict
+from datetime import datetime
+import io
+import logging
+import os
+
+log = logging.getLogger(__name__)
+
+
+class SourceCache(object):
+    """
+    Holds the lines of recently used source files, keyed by path and checked against the file's
+    modification time and size. Within a batch (see `begin_batch`), each file is looked up on disk at
+    most once, and only read again if it changed since it was cached.
+    """
+
+    def __init__(self, maxFiles=256):
+        self.maxFiles = maxFiles
+        self._files = OrderedDict()
+        self._batch = {}
+
+    def begin_batch(self):
+        """
+        Start a new batch. Files seen in earlier batches are checked for changes again.
+        """
+        self._batch = {}
+
+    def get(self, path):
+        """
+        Return `(mtime, lines)` for the file at `path`, or None if it can't be read.
+        """
+        try:
+            return self._batch[path]
+        except KeyError:
+            pass
+
+        entry = None
+        try:
+            st = os.stat(path)
+            cached = self._files.pop(path, None)
+            if cached is not None and cached[0] == st.st_mtime and cached[1] == st.st_size:
+                lines = cached[2]
+            else:
+                lines = read_source(path)
+            self._files[path] = (st.st_mtime, st.st_size, lines)
+            if len(self._files) > self.maxFiles:
+                self._files.popitem(last=False)
+            entry = (st.st_mtime, lines)
+        except (IOError, OSError, SyntaxError, ValueError) as e:
+            log.debug("Unable to read source from %s: %s", path, e)
+
+        self._batch[path] = entry
+        return entry
+
+
+def read_source(path):
+    """
+    Read a Python source file as a list of lines, honoring its encoding declaration if possible.
+    """
+    try:
+        import tokenize
+        with tokenize.open(path) as f:
+            return f.read().splitlines()
+    except AttributeError:
+        with io.open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()
+
+
+_shared_cache = SourceCache()
+
+
+def get_shared_cache():
+    """
+    Return the `SourceCache` shared by all clients in this process.
+    """
+    return _shared_cache
+
+
+def parse_time(text):
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(text, fmt)
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+def add_source_context(args, cache, contextLines, revision=None):
+    """
+    Add `source_context` to the occurrence `args`: a list matching the crashed thread's backtrace,
+    with `{"start_line": ..., "lines": [...]}` for each frame, or None where no source was available.
+
+    Nothing is added if the occurrence was recorded at a revision other than `revision`, since the
+    files on disk are then from different code. Frames whose file was modified after the occurrence
+    happened are skipped for the same reason.
+    """
+    if revision is not None and args.get('revision') != revision:
+        log.debug("Occurrence %s is from revision %s, not adding source context", args.get('UUID'), args.get('revision'))
+        return
+
+    occurred_at = parse_time(args.get('occurred_at'))
+    root = args.get('script_dir') or ''
+
+    try:
+        backtrace = args['backtraces'][0]['backtrace']
+    except (KeyError, IndexError, TypeError):
+        return
+
+    context = []
+    for element in backtrace:
+        path = element.get('file')
+        lineno = element.get('line')
+        entry = None
+        if path and lineno:
+            entry = cache.get(os.path.join(root, path))
+
+        if entry is None or lineno > len(entry[1]):
+            context.append(None)
+            continue
+
+        mtime, lines = entry
+        if occurred_at is not None and datetime.fromtimestamp(mtime) > occurred_at:
+            context.append(None)
+            continue
+
+        start = max(1, lineno - contextLines)
+        context.append({
+            "start_line": start,
+            "lines": lines[start - 1:lineno + contextLines],
+        })
+
+    args['source_context'] = context
@@ -0,0 +1,135 @@
+"""
+    spool
+
+Helpers for reading and writing the folders of saved occurrences (by default "~/.SquashOccurrences/<APIKey>").
+Folders are read one entry at a time, so memory use doesn't grow with the number of occurrences.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import codecs
+import hashlib
+import json
+import os
+
+from squash_python.occurrence import HANDLED_PRIORITY
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class SpoolEntry(object):
+    """
+    One saved occurrence file. `size` and `mtime` are None if the file wasn't `stat`ed; `load` sets
+    `size`.
+    """
+    def __init__(self, path, name, size=None, mtime=None):
+        self.path = path
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+    def load(self):
+        """
+        Read and decode the occurrence's arguments.
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+        self.size = len(data)
+        return json.loads(data.decode('utf-8'))
+
+    def delete(self):
+        os.unlink(self.path)
+
+
+def iter_entries(folder):
+    """
+    Yield a `SpoolEntry` for each occurrence file in `folder`, in directory order. Temporary files
+    left by `write_occurrence` are skipped.
+    """
+    if scandir is not None:
+        for dirent in scandir(folder):
+            if dirent.name.startswith('.') or not dirent.is_file():
+                continue
+            try:
+                st = dirent.stat()
+            except OSError:
+                continue  # Removed since the listing was read
+            yield SpoolEntry(dirent.path, dirent.name, st.st_size, st.st_mtime)
+    else:
+        for name in os.listdir(folder):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield SpoolEntry(path, name, st.st_size, st.st_mtime)
+
+
+def iter_names(folder):
+    """
+    Yield the name of each occurrence file in `folder`, in directory order, without a `stat` call
+    per file where the platform allows it. Temporary files left by `write_occurrence` are skipped.
+    """
+    if scandir is not None:
+        for dirent in scandir(folder):
+            if not dirent.name.startswith('.') and dirent.is_file():
+                yield dirent.name
+    else:
+        for name in os.listdir(folder):
+            if not name.startswith('.'):
+                yield name
+
+
+def iter_folders(root, api_key=None):
+    """
+    Yield the occurrence folder for `api_key` under `root`, or every API key's folder if `api_key`
+    is None.
+    """
+    if api_key is not None:
+        folder = os.path.join(root, api_key)
+        if os.path.isdir(folder):
+            yield folder
+        return
+    if not os.path.isdir(root):
+        return
+    for name in sorted(os.listdir(root)):
+        folder = os.path.join(root, name)
+        if os.path.isdir(folder):
+            yield folder
+
+
+def fingerprint(args):
+    """
+    Return a short hash identifying the bug an occurrence belongs to: its class name and the file,
+    line and symbol of the innermost frame of the crashed thread.
+    """
+    try:
+        top = args['backtraces'][0]['backtrace'][0]
+        location = "%s:%s:%s" % (top.get('file'), top.get('line'), top.get('symbol'))
+    except (KeyError, IndexError, TypeError):
+        location = ""
+    key = "%s|%s" % (args.get('class_name'), location)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+
+def write_occurrence(folder, args, indent=None, priority=HANDLED_PRIORITY):
+    """
+    Save the occurrence `args` in `folder`, named "<priority>-<UUID>" as `SquashClient.record` names
+    them, so `reportErrors` sends it in order. The file is written under a temporary name and renamed
+    into place, so a concurrent reader never sees a partial file.
+    """
+    filename = os.path.join(folder, "%d-%s" % (priority, args['UUID']))
+    tmpname = os.path.join(folder, "." + args['UUID'] + ".tmp")
+    with codecs.open(tmpname, "wb", encoding="utf-8") as f:
+        f.write(json.dumps(args, indent=indent))
+    _replace(tmpname, filename)
+    return filename
@@ -5,14 +5,137 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import argparse
 from datetime import datetime
+import io
+import json
 import os
-import subprocess
 import sys
+import threading
+import time
+try:
+    import Queue as queue
+    import urllib2 as urlerror
+except ImportError:
+    import queue
+    import urllib.error as urlerror
 
 import squash_python
+from squash_python.revision import get_revision
 
 import logging
 logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+deployPath = "/api/1.0/deploy.json"
+
+
+class Target(object):
+    """
+    One Squash project and environment to notify of a deployment.
+    """
+    def __init__(self, host, api_key, environment):
+        self.host = host
+        self.api_key = api_key
+        self.environment = environment
+
+    def __str__(self):
+        return "%s (%s, key %s...)" % (self.host, self.environment, self.api_key[:8])
+
+
+def load_manifest(path):
+    """
+    Read a list of targets from a JSON manifest file. The file contains a list of objects, each with
+    the keys "host", "api_key", and "environment"::
+
+        [
+            {"host": "https://squash.example.com", "api_key": "...", "environment": "production"},
+            {"host": "https://squash.example.com", "api_key": "...", "environment": "staging"}
+        ]
+    """
+    with io.open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    targets = []
+    for i, entry in enumerate(entries):
+        try:
+            targets.append(Target(entry['host'], entry['api_key'], entry['environment']))
+        except KeyError as e:
+            raise ValueError("Manifest entry %d is missing %s" % (i, e))
+    return targets
+
+
+def is_retryable(e):
+    """
+    Connection failures and server errors are worth retrying; other HTTP errors (e.g. 403 for a bad
+    API key, 422 for bad data) will fail again the same way.
+    """
+    if isinstance(e, urlerror.HTTPError):
+        return e.code >= 500
+    return isinstance(e, urlerror.URLError)
+
+
+def notify_all(targets, deploy, timeout=None, jobs=8, retries=3, backoff=0.5):
+    """
+    Send the `deploy` record to every target in `targets` concurrently, using up to `jobs` threads.
+    Each thread keeps one connection open per host and reuses it for every target on that host.
+    Retryable failures are retried up to `retries` times with exponential backoff.
+
+    Returns a list of `(target, error)` tuples in the order of `targets`, where `error` is None if
+    the notification succeeded.
+    """
+    pending = queue.Queue()
+    # Targets on the same host are queued together so a worker tends to reuse its connection.
+    for index, target in sorted(enumerate(targets), key=lambda item: item[1].host):
+        pending.put((index, target))
+
+    results = [None] * len(targets)
+
+    def worker():
+        uploaders = {}
+        try:
+            while True:
+                try:
+                    index, target = pending.get_nowait()
+                except queue.Empty:
+                    return
+
+                uploader = uploaders.get(target.host)
+                if uploader is None:
+                    uploader = uploaders[target.host] = squash_python.SquashUploader(target.host, timeout=timeout,
+                                                                                     keepalive=True)
+
+                payload = {
+                    'project'     : {'api_key' : target.api_key},
+                    'environment' : {'name' : target.environment},
+                    'deploy'      : deploy,
+                }
+
+                error = None
+                for attempt in range(retries + 1):
+                    try:
+                        uploader.transmit(deployPath, payload)
+                        error = None
+                        break
+                    except Exception as e:
+                        error = e
+                        if not is_retryable(e) or attempt == retries:
+                            break
+                        log.warn("%s: %s, retrying (%d/%d)", target, e, attempt + 1, retries)
+                        time.sleep(backoff * 2 ** attempt)
+
+                results[index] = (target, error)
+        finally:
+            for uploader in uploaders.values():
+                uploader.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(jobs, len(targets))))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+
+    return results
+
 
 def main():
     argv = sys.argv
@@ -25,33 +148,54 @@ def main():
     parser.add_argument('-r', '--revision', help="Specify a code revision that was deployed (default current revision)")
     parser.add_argument('-b', '--build', help="Specify a machine-readable build number that was deployed")
     parser.add_argument('-v', '--product-version', dest='version', help="Specify a human-readable version that was deployed. If not specified, use the build number.")
-    parser.add_argument('host', help="The host and port of the machine running the Squash server")
-    parser.add_argument('api_key', help="The API key for this project")
-    parser.add_argument('environment', help="The name of the current deployment environment")
+    parser.add_argument('-m', '--manifest', help="""Notify every target listed in this JSON file, in addition to the one given on the
+                        command line. The file contains a list of objects with the keys "host", "api_key" and "environment".""")
+    parser.add_argument('-j', '--jobs', type=int, default=8, help="Number of targets to notify concurrently (default 8)")
+    parser.add_argument('--retries', type=int, default=3, help="Number of times to retry a target after a connection or server error (default 3)")
+    parser.add_argument('host', nargs='?', help="The host and port of the machine running the Squash server")
+    parser.add_argument('api_key', nargs='?', help="The API key for this project")
+    parser.add_argument('environment', nargs='?', help="The name of the current deployment environment")
 
     parser.add_argument('-V', '--version', action='version', version="1.0.0")
     args = parser.parse_args(argv[1:])
 
+    targets = []
+    if args.host is not None:
+        if args.environment is None:
+            parser.error("host, api_key and environment must be given together")
+        targets.append(Target(args.host, args.api_key, args.environment))
+    if args.manifest is not None:
+        targets.extend(load_manifest(args.manifest))
+    if not targets:
+        parser.error("specify host, api_key and environment, or a manifest")
+
     if args.project_dir is None:
         args.project_dir = os.getcwd()
 
-    os.chdir(args.project_dir)
-
     if args.revision is None:
-        args.revision = subprocess.check_output('git rev-parse HEAD'.split()).strip()
-
-    uploader = squash_python.SquashUploader(args.host, timeout = args.timeout)
-    uploader.transmit("/api/1.0/deploy.json",
-                      {
-                         'project'     : {'api_key' : args.api_key},
-                         'environment' : {'name' : args.environment},
-                         'deploy'      : {
-                             'deployed_at' : datetime.now().isoformat(),
-                             'revision'    : args.revision,
-                             'build'       : args.build,
-                             'version'     : args.version or args.build,
-                         }
-                     })
+        args.revision = get_revision(args.project_dir)
+
+    deploy = {
+        'deployed_at' : datetime.now().isoformat(),
+        'revision'    : args.revision,
+        'build'       : args.build,
+        'version'     : args.version or args.build,
+    }
+
+    results = notify_all(targets, deploy, timeout=args.timeout, jobs=args.jobs, retries=args.retries)
+
+    failures = 0
+    for target, error in results:
+        if error is None:
+            print("OK      %s" % target)
+        else:
+            failures += 1
+            print("FAILED  %s: %s" % (target, error))
+
+    if failures:
+        print("%d of %d notifications failed." % (failures, len(results)))
+        return 1
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
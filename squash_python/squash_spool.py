@@ -0,0 +1,304 @@
+"""
+    squash_spool
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+from collections import Counter
+import codecs
+import io
+import json
+import os
+import sys
+import time
+try:
+    import urllib2 as urlerror
+except ImportError:
+    import urllib.error as urlerror
+
+import squash_python
+from squash_python.drain import entry_priority
+from squash_python.occurrence import HANDLED_PRIORITY, SIGNAL_PRIORITY
+from squash_python.spool import fingerprint, iter_entries, iter_folders, write_occurrence
+
+import logging
+logging.basicConfig(level=logging.WARNING)
+log = logging.getLogger(__name__)
+
+# Key added to exported occurrences to carry the priority encoded in their file name; removed on import.
+priority_key = 'spool_priority'
+
+age_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+age_buckets = [
+    (3600, "< 1 hour"),
+    (86400, "< 1 day"),
+    (604800, "< 1 week"),
+    (None, ">= 1 week"),
+]
+
+
+def parse_age(text):
+    """
+    Parse an age such as "90", "30m", "12h" or "7d" into seconds.
+    """
+    unit = age_units.get(text[-1:].lower())
+    if unit is None:
+        return float(text)
+    return float(text[:-1]) * unit
+
+
+def select(options, need_args=True):
+    """
+    Yield `(entry, args)` for each saved occurrence matching the filters in `options`. `args` is
+    only loaded if `need_args` is True or a filter needs it; otherwise it is None.
+    """
+    now = time.time()
+    load = need_args or options.class_name or options.fingerprint
+
+    for folder in iter_folders(options.folder, options.api_key):
+        for entry in iter_entries(folder):
+            age = now - entry.mtime
+            if options.older_than is not None and age < options.older_than:
+                continue
+            if options.newer_than is not None and age > options.newer_than:
+                continue
+
+            args = None
+            if load:
+                try:
+                    args = entry.load()
+                except (IOError, OSError, ValueError) as e:
+                    log.warn("Unable to read %s: %s", entry.path, e)
+                    continue
+                if options.class_name and args.get('class_name') != options.class_name:
+                    continue
+                if options.fingerprint and fingerprint(args) != options.fingerprint:
+                    continue
+
+            yield entry, args
+
+
+def cmd_stats(options):
+    count = 0
+    total_size = 0
+    classes = Counter()
+    fingerprints = Counter()
+    fingerprint_classes = {}
+    ages = Counter()
+    now = time.time()
+
+    for entry, args in select(options):
+        count += 1
+        total_size += entry.size
+        class_name = args.get('class_name')
+        classes[class_name] += 1
+        fp = fingerprint(args)
+        fingerprints[fp] += 1
+        fingerprint_classes[fp] = class_name
+        age = now - entry.mtime
+        for limit, label in age_buckets:
+            if limit is None or age < limit:
+                ages[label] += 1
+                break
+
+    print("Occurrences: %d" % count)
+    print("Total size:  %d bytes" % total_size)
+    if not count:
+        return 0
+    print("Mean size:   %d bytes" % (total_size // count))
+
+    print("\nBy age:")
+    for limit, label in age_buckets:
+        print("  %8d  %s" % (ages[label], label))
+
+    print("\nBy class:")
+    for class_name, n in classes.most_common(options.top):
+        print("  %8d  %s" % (n, class_name))
+
+    print("\nBy fingerprint:")
+    for fp, n in fingerprints.most_common(options.top):
+        print("  %8d  %s  %s" % (n, fp, fingerprint_classes[fp]))
+    return 0
+
+
+def cmd_list(options):
+    now = time.time()
+    for entry, args in select(options):
+        message = (args.get('message') or '').replace('\n', ' ')
+        if len(message) > 60:
+            message = message[:57] + '...'
+        print("%s  %8s  %7d  %s  %s: %s" % (entry.name, format_age(now - entry.mtime), entry.size,
+                                           fingerprint(args), args.get('class_name'), message))
+    return 0
+
+
+def format_age(seconds):
+    for unit in ('w', 'd', 'h', 'm'):
+        if seconds >= age_units[unit]:
+            return "%d%s" % (seconds // age_units[unit], unit)
+    return "%ds" % seconds
+
+
+def cmd_export(options):
+    if options.output and options.output != '-':
+        out = codecs.open(options.output, "w", encoding="utf-8")
+    else:
+        out = sys.stdout
+    try:
+        count = 0
+        for entry, args in select(options):
+            args[priority_key] = entry_priority(entry.name)
+            out.write(json.dumps(args) + "\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    log.info("Exported %d occurrences", count)
+    return 0
+
+
+def cmd_import(options):
+    if options.input and options.input != '-':
+        source = io.open(options.input, "r", encoding="utf-8")
+    else:
+        source = sys.stdin
+    count = 0
+    try:
+        for lineno, line in enumerate(source, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                args = json.loads(line)
+                priority = int(args.pop(priority_key, HANDLED_PRIORITY))
+                if not SIGNAL_PRIORITY <= priority <= HANDLED_PRIORITY:
+                    # Only these fit in the file name where `squash_python.drain` reads them.
+                    log.warn("Line %d: priority %d is out of range, using %d", lineno, priority, HANDLED_PRIORITY)
+                    priority = HANDLED_PRIORITY
+                if options.api_key:
+                    args['api_key'] = options.api_key
+                api_key = args['api_key']
+                args['UUID']
+            except (ValueError, KeyError) as e:
+                log.warn("Skipping line %d: %s", lineno, e)
+                continue
+            folder = os.path.join(options.folder, api_key)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            write_occurrence(folder, args, priority=priority)
+            count += 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    print("Imported %d occurrences." % count)
+    return 0
+
+
+def cmd_replay(options):
+    uploader = squash_python.SquashUploader(options.host, timeout=options.timeout, keepalive=True)
+    sent = failed = 0
+    try:
+        for entry, args in select(options):
+            try:
+                uploader.transmit(options.notify_path, args)
+            except urlerror.HTTPError as e:
+                if e.code == 403:
+                    print("Error: 403 Forbidden (Server refused API key). Aborting.")
+                    failed += 1
+                    break
+                failed += 1
+                log.warn("Error: %s (UUID %s)", e, args.get('UUID'))
+                if e.code == 422 and not options.keep:
+                    entry.delete()  # The server will never accept it
+                continue
+            except urlerror.URLError as e:
+                print("Error: %s. Aborting." % e)
+                failed += 1
+                break
+
+            sent += 1
+            if not options.keep:
+                entry.delete()
+    finally:
+        uploader.close()
+
+    print("Sent %d occurrences, %d failed." % (sent, failed))
+    return 1 if failed else 0
+
+
+def cmd_purge(options):
+    filtered = (options.api_key or options.class_name or options.fingerprint or
+                options.older_than is not None or options.newer_than is not None)
+    if not (filtered or options.all):
+        print("Error: purge needs a filter, or --all to delete every occurrence.")
+        return 2
+
+    count = 0
+    for entry, args in select(options, need_args=False):
+        if not options.dry_run:
+            try:
+                entry.delete()
+            except OSError as e:
+                log.warn("Unable to delete %s: %s", entry.path, e)
+                continue
+        count += 1
+
+    print("%s %d occurrences." % ("Would delete" if options.dry_run else "Deleted", count))
+    return 0
+
+
+def main():
+    argv = sys.argv
+    parser = argparse.ArgumentParser(description="Inspect, export, import, replay and purge the occurrences saved by squash_python.")
+    parser.add_argument('-d', '--folder', default=squash_python.SquashClient.occurrence_folder,
+                        help="Folder containing saved occurrences (default %(default)s)")
+    parser.add_argument('-V', '--version', action='version', version="1.0.0")
+
+    filters = argparse.ArgumentParser(add_help=False)
+    group = filters.add_argument_group("filters")
+    group.add_argument('-k', '--api-key', help="Only occurrences for this API key")
+    group.add_argument('-c', '--class', dest='class_name', help="Only occurrences of this exception class")
+    group.add_argument('-f', '--fingerprint', help="Only occurrences with this fingerprint (as shown by list and stats)")
+    group.add_argument('--older-than', type=parse_age, help="Only occurrences saved longer ago than this (e.g. 90, 30m, 12h, 7d)")
+    group.add_argument('--newer-than', type=parse_age, help="Only occurrences saved more recently than this")
+
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('stats', parents=[filters], help="Count occurrences by age, class and fingerprint")
+    cmd.add_argument('--top', type=int, default=10, help="Number of classes and fingerprints to show (default 10)")
+    cmd.set_defaults(func=cmd_stats)
+
+    cmd = commands.add_parser('list', parents=[filters], help="List occurrences, one per line")
+    cmd.set_defaults(func=cmd_list)
+
+    cmd = commands.add_parser('export', parents=[filters], help="Write occurrences as newline-delimited JSON, with their priority as %s" % priority_key)
+    cmd.add_argument('-o', '--output', help="File to write (default standard output)")
+    cmd.set_defaults(func=cmd_export)
+
+    cmd = commands.add_parser('import', help="Save occurrences from newline-delimited JSON, e.g. exported on another host")
+    cmd.add_argument('input', nargs='?', help="File to read (default standard input)")
+    cmd.add_argument('-k', '--api-key', help="Save under this API key instead of each occurrence's own")
+    cmd.set_defaults(func=cmd_import)
+
+    cmd = commands.add_parser('replay', parents=[filters], help="Send occurrences to a Squash server, deleting them once sent")
+    cmd.add_argument('host', help="The host and port of the machine running the Squash server")
+    cmd.add_argument('--notify-path', default="/api/1.0/notify", help="API path to post occurrences to (default %(default)s)")
+    cmd.add_argument('-t', '--timeout', type=int, default=15, help="HTTP connection timeout (default %(default)s)")
+    cmd.add_argument('--keep', action='store_true', help="Don't delete occurrences after sending them")
+    cmd.set_defaults(func=cmd_replay)
+
+    cmd = commands.add_parser('purge', parents=[filters], help="Delete occurrences")
+    cmd.add_argument('--all', action='store_true', help="Allow deleting every occurrence when no filter is given")
+    cmd.add_argument('-n', '--dry-run', action='store_true', help="Only count what would be deleted")
+    cmd.set_defaults(func=cmd_purge)
+
+    options = parser.parse_args(argv[1:])
+    for name in ('class_name', 'fingerprint', 'older_than', 'newer_than'):
+        if not hasattr(options, name):
+            setattr(options, name, None)
+    return options.func(options)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,8 +3,10 @@ import os
 import subprocess
 import sys
 import signal
+import threading
 import time
 import argparse
+import multiprocessing
 
 import squash_python
 
@@ -34,6 +36,27 @@ class SquashTester(object):
                             help="""Only send previously recorded exceptions.
                             """)
 
+        parser.add_argument("-L", "--load", action="store_true",
+                            help="""Record many non-fatal exceptions at a fixed rate, then send them all, and print
+                            latency percentiles for recording and the throughput of the whole run. See the
+                            options below to shape the load. This overrides -s, -c and -i.""")
+
+        load = parser.add_argument_group("load options", "Options used with -L.")
+        load.add_argument("--rate", type=float, default=100.0,
+                          help="Total occurrences recorded per second across all workers (default 100)")
+        load.add_argument("--duration", type=float, default=10.0,
+                          help="Seconds to spend recording occurrences (default 10)")
+        load.add_argument("--threads", type=int, default=4,
+                          help="Recording threads per process (default 4)")
+        load.add_argument("--processes", type=int, default=1,
+                          help="Recording processes (default 1)")
+        load.add_argument("--depth", type=int, default=20,
+                          help="Stack depth at which each exception is raised (default 20)")
+        load.add_argument("--message-size", type=int, default=100,
+                          help="Length of each exception message in characters (default 100)")
+        load.add_argument("--fingerprints", type=int, default=10,
+                          help="Number of distinct exception classes to spread the load over (default 10)")
+
         parser.add_argument("-r", "--revision", action="store", dest='rev',
                             help="""Specify the Git revision to send with the exception. If not specified, uses
                             `git rev-parse HEAD` to get the revision from the current directory.""")
@@ -47,6 +70,8 @@ class SquashTester(object):
         parser.epilog = "Before taking any other action, squash_tester reports all previously recorded errors."
 
         args = parser.parse_args(argv[1:])
+        if args.load and args.rate <= 0:
+            parser.error("--rate must be greater than 0")
 
         client = squash_python.get_client()
         client.APIKey = os.getenv('SQUASH_TESTER_API_KEY', args.apikey)
@@ -70,7 +95,9 @@ class SquashTester(object):
         client.reportErrors()
         client.hook()
 
-        if args.signal:
+        if args.load:
+            run_load(client, args)
+        elif args.signal:
             print("Raising SIGABRT...")
             os.kill(os.getpid(), signal.SIGABRT)
             print("Signal recorded. Run squash_tester again to send it.")
@@ -92,6 +119,155 @@ class SquashTester(object):
 def raise_it():
     raise STBoomException("At the boom the time will be %s seconds since the epoch. Boom!" % time.time())
 
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+def raise_deep(depth, exc_class, message):
+    if depth > 1:
+        raise_deep(depth - 1, exc_class, message)
+    raise exc_class(message)
+
+
+def load_exception_classes(count):
+    """
+    Return `count` distinct subclasses of `STBoomException`. Squash groups occurrences by class name,
+    so this controls how many separate bugs the load is spread across.
+    """
+    return [type(str("STBoomException%d" % i), (STBoomException,), {}) for i in range(max(1, count))]
+
+
+def load_worker(args, worker_id, rate, deadline, latencies):
+    """
+    Record exceptions at `rate` per second until `deadline`, appending the time taken by each call to
+    `SquashClient.recordException` to `latencies`.
+    """
+    client = squash_python.get_client()
+    classes = load_exception_classes(args.fingerprints)
+    message = ("Load test occurrence %d. " % worker_id).ljust(args.message_size, "x")[:args.message_size]
+    interval = 1.0 / rate
+    next_time = clock()
+    n = 0
+
+    while True:
+        now = clock()
+        if now >= deadline:
+            break
+        if now < next_time:
+            time.sleep(next_time - now)
+        next_time += interval
+
+        try:
+            raise_deep(args.depth, classes[(worker_id + n) % len(classes)], message)
+        except STBoomException:
+            start = clock()
+            client.recordException(*sys.exc_info())
+            latencies.append(clock() - start)
+        n += 1
+
+
+def load_process(config, args, process_id, rate_per_thread, duration):
+    """
+    Run `args.threads` load workers in this process and return their combined latencies. When run in a
+    child process the shared client is configured from `config` first, since it may not be inherited.
+    """
+    client = squash_python.get_client()
+    client.APIKey, client.environment, client.host, client.revision = config
+    logging.getLogger("squash_python").setLevel(logging.WARNING)
+
+    latencies = []
+    deadline = clock() + duration
+    threads = [threading.Thread(target=load_worker,
+                                args=(args, process_id * args.threads + i, rate_per_thread, deadline, latencies))
+               for i in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(p / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class CountingUploader(squash_python.SquashUploader):
+    """
+    Counts the occurrences the server accepted, in `sent`, across every instance.
+    """
+    sent = 0
+
+    def transmit(self, location, args):
+        result = super(CountingUploader, self).transmit(location, args)
+        CountingUploader.sent += 1
+        return result
+
+
+def run_load(client, args):
+    """
+    Record occurrences at the requested rate across threads and processes, then drain them all to the
+    server, and print the recording latency percentiles and the throughput of each phase.
+    """
+    # Per-occurrence debug logging would dominate the measurements.
+    logging.getLogger("squash_python").setLevel(logging.WARNING)
+
+    config = (client.APIKey, client.environment, client.host, client.revision)
+    workers = max(1, args.threads) * max(1, args.processes)
+    rate_per_thread = args.rate / workers
+
+    print("Recording for %.1f seconds at %.1f occurrences/second (%d processes x %d threads, depth %d, "
+          "%d byte messages, %d fingerprints)..." % (args.duration, args.rate, args.processes, args.threads,
+                                                     args.depth, args.message_size, args.fingerprints))
+
+    record_start = clock()
+    if args.processes > 1:
+        pool = multiprocessing.Pool(args.processes)
+        try:
+            results = [pool.apply_async(load_process, (config, args, i, rate_per_thread, args.duration))
+                       for i in range(args.processes)]
+            latencies = []
+            for r in results:
+                latencies.extend(r.get())
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        latencies = load_process(config, args, 0, rate_per_thread, args.duration)
+    record_time = clock() - record_start
+
+    folder = client.get_occurrence_folder()
+    pending = len(os.listdir(folder))
+    print("Sending %d occurrences to %s..." % (pending, client.host))
+    # `reportErrors` deletes occurrences the server refused as well as those it accepted, so count
+    # the uploads that succeeded instead.
+    uploader_class = squash_python.SquashUploader
+    squash_python.SquashUploader = CountingUploader
+    CountingUploader.sent = 0
+    drain_start = clock()
+    try:
+        client.reportErrors()
+    finally:
+        squash_python.SquashUploader = uploader_class
+    drain_time = clock() - drain_start
+    sent = CountingUploader.sent
+
+    latencies.sort()
+    count = len(latencies)
+    print()
+    print("Recorded:        %d occurrences in %.2f s (%.1f/s)" % (count, record_time, count / record_time))
+    print("Record latency:  p50 %.3f ms  p90 %.3f ms  p99 %.3f ms  p99.9 %.3f ms  max %.3f ms" % tuple(
+          percentile(latencies, p) * 1000 for p in (50, 90, 99, 99.9, 100)))
+    if count:
+        print("Record mean:     %.3f ms" % (sum(latencies) / count * 1000))
+    print("Sent:            %d of %d occurrences in %.2f s (%.1f/s)" % (sent, pending, drain_time,
+                                                                        sent / drain_time if drain_time else 0))
+    print("End to end:      %.1f occurrences/s" % (min(count, sent) / (record_time + drain_time)))
+
 
 
 def main():
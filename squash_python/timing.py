@@ -0,0 +1,105 @@
+"""
+    timing
+
+Reports operations that take longer than they should, as occurrences of class "Slow Operation".
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import functools
+import logging
+import random
+import sys
+import threading
+
+from squash_python.occurrence import Occurrence, clock, get_frames, relpath
+
+log = logging.getLogger(__name__)
+
+# When each operation was last reported, shared by every `SlowOperation` timing it.
+_last_reports = {}
+_last_reports_lock = threading.Lock()
+
+
+class SlowOperation(object):
+    """
+    Times a block of code, as a context manager or a decorator, and records an occurrence through
+    `client` when it takes longer than `threshold` seconds. The occurrence has class "Slow Operation",
+    the stack where the block ended, and the fields `operation`, `elapsed` and `threshold`.
+
+    Only a `sampleRate` fraction of slow runs are reported, and each operation at most once every
+    `reportInterval` seconds. Operations are told apart by `name`, which defaults to the decorated
+    function's qualified name, or to the file and line of the ``with`` statement.
+
+    A block that finishes in time costs two calls to the clock. Used as a context manager, an instance
+    holds the start time of the block, so create one per ``with`` statement rather than sharing it
+    between threads; a decorated function can be called from any number of threads.
+    """
+
+    def __init__(self, client, name=None, threshold=1.0, sampleRate=1.0, reportInterval=60):
+        self.client = client
+        self.name = name
+        self.threshold = threshold
+        self.sampleRate = sampleRate
+        self.reportInterval = reportInterval
+        self._start = None
+
+    def __enter__(self):
+        self._start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        elapsed = clock() - self._start
+        if elapsed > self.threshold:
+            frame = sys._getframe(1)
+            site = self.name or "%s:%d" % (relpath(frame.f_code.co_filename), frame.f_lineno)
+            self.report(site, elapsed, get_frames(frame))
+        return False
+
+    def __call__(self, func):
+        name = self.name or "%s.%s" % (func.__module__, getattr(func, '__qualname__', func.__name__))
+        code = getattr(func, '__code__', None)
+        threshold = self.threshold
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                if elapsed > threshold:
+                    # The function has returned, so stand in a frame for it above its caller's stack.
+                    frames = [(code.co_filename, code.co_firstlineno, code.co_name)] if code is not None else []
+                    frames.extend(get_frames(sys._getframe(1)))
+                    self.report(name, elapsed, frames)
+        return wrapper
+
+    def report(self, site, elapsed, frames):
+        """
+        Record that operation `site` took `elapsed` seconds, unless sampled out or reported too recently.
+        Errors are logged rather than raised into the timed code.
+        """
+        if self.client.disabled:
+            return
+        if self.sampleRate < 1 and random.random() >= self.sampleRate:
+            return
+
+        now = clock()
+        with _last_reports_lock:
+            last = _last_reports.get(site)
+            if last is not None and now - last < self.reportInterval:
+                log.debug("Not reporting slow operation %s: rate limited", site)
+                return
+            _last_reports[site] = now
+
+        try:
+            message = "%s took %.3f seconds (threshold %.3f)" % (site, elapsed, self.threshold)
+            occ = Occurrence.from_stack("Slow Operation", message, frames)
+            occ.update({
+                'operation': site,
+                'elapsed': elapsed,
+                'threshold': self.threshold,
+            })
+            self.client.record(occ)
+        except Exception as e:
+            log.warn("%s while recording slow operation %s", e, site)
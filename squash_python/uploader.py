@@ -3,30 +3,63 @@
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import errno
+import io
 import json
+import socket
 try:
     import urllib2 as urlrequest
+    import urllib2 as urlerror
+    import httplib
+    from urlparse import urlsplit
 except ImportError:
     import urllib.request as urlrequest
+    import urllib.error as urlerror
+    import http.client as httplib
+    from urllib.parse import urlsplit
 import sys
 import logging
 log = logging.getLogger(__name__)
 
+
+def _closed_before_response(e):
+    """
+    Return True if the error `e` from a request on a reused connection shows the server had already
+    closed it: the request couldn't be written, or the connection ended without a byte of response.
+    The request can then be sent again without the server having seen it twice. Timeouts never count.
+    """
+    if isinstance(e, socket.timeout):
+        return False
+    remote_disconnected = getattr(httplib, 'RemoteDisconnected', None)
+    if remote_disconnected is not None:
+        if isinstance(e, remote_disconnected):
+            return True
+    elif isinstance(e, httplib.BadStatusLine) and e.line in ("", "''"):
+        return True
+    return isinstance(e, socket.error) and e.errno in (errno.EPIPE, errno.ECONNRESET)
+
+
 class SquashUploader(object):
-    def __init__(self, host, timeout=None):
+    def __init__(self, host, timeout=None, keepalive=False):
         """
         :param host: The host, port, and scheme of the Squash server (e.g. "https://squash.mycompany.com:3000")
         :type host: string
         :param timeout: Socket timeout in seconds. If none, uses :mod:`socket` default.
+        :param keepalive: If True, hold a single HTTP/1.1 connection open and reuse it for every call
+                          to `transmit` until `close` is called. An uploader with `keepalive` set
+                          must not be shared between threads.
+        :type keepalive: bool
         """
         self.host = host
         self.timeout = timeout
+        self.keepalive = keepalive
+        self._connection = None
 
     headers = { "Content-type": "application/json" ,
                 "Content-encoding": "utf-8",
                 "Accept-encoding": "utf-8",
                 }
-    
+
     def transmit(self, location, args):
         """
         Convert the dictionary `args` into a json string and POST it to `location`. Raise `urllib2.HTTPError` if
@@ -44,19 +77,73 @@ class SquashUploader(object):
         args = dict(args)
         args['utf8'] = '\u2713'
 
-        data = json.dumps(args)
+        data = json.dumps(args).encode('utf-8')
 
-
-        req = urlrequest.Request(self.host + location, data, self.headers)
-
-        if self.timeout:
-            response = urlrequest.urlopen(req, None, self.timeout)
+        if self.keepalive:
+            code, data = self._post(location, data)
         else:
-            response = urlrequest.urlopen(req)
+            req = urlrequest.Request(self.host + location, data, self.headers)
 
-        code = response.code
-        data = response.fp.read()
+            if self.timeout:
+                response = urlrequest.urlopen(req, None, self.timeout)
+            else:
+                response = urlrequest.urlopen(req)
+
+            code = response.code
+            data = response.fp.read()
 
         log.info("Response status: %s\nResponse data: \n%s\n" % (code, data))
 
+    def close(self):
+        """
+        Close the connection held open by a `keepalive` uploader, if any. The next call to `transmit`
+        opens a new one.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            parts = urlsplit(self.host)
+            if parts.scheme == "https":
+                cls = httplib.HTTPSConnection
+            else:
+                cls = httplib.HTTPConnection
+            if self.timeout:
+                self._connection = cls(parts.netloc, timeout=self.timeout)
+            else:
+                self._connection = cls(parts.netloc)
+            self._reused = False
+        return self._connection
+
+    def _post(self, location, data):
+        """
+        POST `data` over the persistent connection, sending it once more on a new connection if a
+        previously used one turns out to have been closed by the server before it answered (see
+        `_closed_before_response`). Errors are raised as `urllib2.HTTPError` and `urllib2.URLError` so
+        callers handle both modes the same way.
+        """
+        url = self.host + location
+        path = urlsplit(self.host).path.rstrip('/') + location
+
+        while True:
+            conn = self._get_connection()
+            reused = self._reused
+            try:
+                conn.request("POST", path, data, self.headers)
+                response = conn.getresponse()
+                body = response.read()
+                break
+            except (httplib.HTTPException, socket.error) as e:
+                self.close()
+                if not (reused and _closed_before_response(e)):
+                    raise urlerror.URLError(e)
+                # Keep-alive connection went stale between requests; try once more on a fresh one.
+                log.debug("Connection to %s was closed, reconnecting", self.host)
+
+        self._reused = True
+        if response.status >= 400:
+            raise urlerror.HTTPError(url, response.status, response.reason, response.msg, io.BytesIO(body))
 
+        return response.status, body
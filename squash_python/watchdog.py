@@ -0,0 +1,202 @@
+"""
+    watchdog
+
+Reports hangs: a main thread or asyncio event loop that stops making progress.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+import logging
+import sys
+import threading
+import weakref
+
+from squash_python.occurrence import Occurrence, clock, get_frames
+
+log = logging.getLogger(__name__)
+
+
+def thread_stacks(exclude=()):
+    """
+    Return `{ident: (name, frames)}` for every running thread except those in `exclude`, with frames
+    as `(filename, lineno, name)` tuples, most recent call first.
+    """
+    names = dict((t.ident, t.name) for t in threading.enumerate())
+    stacks = {}
+    for ident, frame in sys._current_frames().items():
+        if ident in exclude:
+            continue
+        stacks[ident] = (names.get(ident, "Thread %d" % ident), list(get_frames(frame)))
+    return stacks
+
+
+def stall_occurrence(class_name, message, ident):
+    """
+    Build an occurrence with the stack of thread `ident` as the crashed thread, followed by the stacks
+    of all other threads, which helps spot deadlocks. Returns None if the thread has exited.
+    """
+    stacks = thread_stacks(exclude=(threading.current_thread().ident,))
+    if ident not in stacks:
+        return None
+    name, frames = stacks.pop(ident)
+    occ = Occurrence.from_stack(class_name, message, frames)
+    for other_name, other_frames in stacks.values():
+        occ.add_thread(other_name, other_frames)
+    occ.set('stalled_thread', name)
+    return occ
+
+
+def dump_occurrence(class_name, message, sig_frame):
+    """
+    Build an occurrence with the stack starting at `sig_frame` as the crashed thread, followed by the
+    stacks of all other threads.
+    """
+    occ = Occurrence.from_stack(class_name, message, get_frames(sig_frame))
+    for name, frames in thread_stacks(exclude=(threading.current_thread().ident,)).values():
+        occ.add_thread(name, frames)
+    return occ
+
+
+class _LoopState(object):
+    def __init__(self, loop):
+        self.loop = weakref.ref(loop)
+        self.thread_ident = None
+        self.probe_sent = None
+        self.reported = False
+
+    def probe_done(self):
+        self.thread_ident = threading.current_thread().ident
+        self.probe_sent = None
+        self.reported = False
+
+
+class StallWatchdog(object):
+    """
+    A daemon thread that checks every `interval` seconds whether the main thread, and each asyncio
+    loop passed to `watch_loop`, has made progress in the last `threshold` seconds. If not, it records
+    an occurrence through `client` with class "Stall" (or "Event Loop Stall") and the stacks of all
+    threads.
+
+    The main thread's innermost frame is sampled every `interval` seconds, and the thread counts as
+    stalled when the same frame has been innermost for `threshold` seconds: it has neither returned
+    nor called anything that was still running when sampled, as in a loop that calls nothing or a wait
+    on a lock that is never released. Waits in the modules named in `idleModules`, such as the `select`
+    of an asyncio loop or a `threading.Event.wait`, aren't stalls; nor are waits inside ``with
+    watchdog.idle():``, which should be used where the main thread only sleeps or waits for a signal.
+    A loop counts as stalled when a callback scheduled with `call_soon_threadsafe` doesn't run.
+
+    Each stall is reported once, and at most one report is made every `reportInterval` seconds.
+    """
+
+    idleModules = frozenset(['threading', 'queue', 'Queue', 'selectors'])
+
+    def __init__(self, client, threshold=5.0, interval=None, watchMain=True, reportInterval=300):
+        self.client = client
+        self.threshold = threshold
+        self.interval = interval or threshold / 4.0
+        self.watchMain = watchMain
+        self.reportInterval = reportInterval
+        self._loops = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_report = None
+        main_thread = getattr(threading, 'main_thread', None)
+        self._main_ident = main_thread().ident if main_thread is not None else None
+        self._main_frame = None
+        self._main_since = None
+        self._main_reported = False
+        self._idle = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="SquashWatchdog")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._main_frame = None
+
+    @contextmanager
+    def idle(self):
+        """
+        Don't count the main thread as stalled while in this block. Has no effect on other threads.
+        """
+        if threading.current_thread().ident != self._main_ident:
+            yield
+            return
+        self._idle += 1
+        try:
+            yield
+        finally:
+            self._idle -= 1
+
+    def watch_loop(self, loop):
+        """
+        Also report stalls of the asyncio event `loop`. It is forgotten once closed or garbage collected.
+        """
+        self._loops.append(_LoopState(loop))
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.watchMain and self._main_ident is not None:
+                    self.check_main(self._main_ident)
+                self.check_loops()
+            except Exception as e:
+                log.warn("%s in stall watchdog", e)
+
+    def check_main(self, ident):
+        now = clock()
+        frame = sys._current_frames().get(ident)
+        if frame is None or self._idle or frame.f_globals.get('__name__') in self.idleModules:
+            self._main_frame = None
+        elif frame is not self._main_frame:
+            # Holding the frame keeps it from being freed and its address reused by the next call.
+            self._main_frame = frame
+            self._main_since = now
+            self._main_reported = False
+        elif not self._main_reported and now - self._main_since >= self.threshold:
+            self._main_reported = True
+            self.report("Stall", "Main thread made no progress for %.1f seconds" % (now - self._main_since), ident)
+        frame = None
+
+    def check_loops(self):
+        now = clock()
+        for state in list(self._loops):
+            loop = state.loop()
+            if loop is None or loop.is_closed():
+                self._loops.remove(state)
+                continue
+            if not loop.is_running():
+                state.probe_sent = None
+                continue
+
+            if state.probe_sent is None:
+                state.probe_sent = now
+                try:
+                    loop.call_soon_threadsafe(state.probe_done)
+                except RuntimeError:
+                    self._loops.remove(state)  # Closed since checked
+            elif not state.reported and now - state.probe_sent >= self.threshold:
+                state.reported = True
+                ident = getattr(loop, '_thread_id', None) or state.thread_ident
+                if ident is not None:
+                    self.report("Event Loop Stall",
+                                "Event loop made no progress for %.1f seconds" % (now - state.probe_sent), ident)
+
+    def report(self, class_name, message, ident):
+        now = clock()
+        if self._last_report is not None and now - self._last_report < self.reportInterval:
+            log.debug("Not reporting %s: rate limited", class_name)
+            return
+        occ = stall_occurrence(class_name, message, ident)
+        if occ is None:
+            return
+        self._last_report = now
+        log.warn("%s", message)
+        if not self.client.disabled:
+            self.client.record(occ)
@@ -0,0 +1,85 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+import pytest
+
+import squash_python
+
+
+@pytest.fixture
+def client(tmpdir):
+    client = squash_python.SquashClient()
+    client.APIKey = "key"
+    client.host = "http://localhost:1"
+    client.environment = "test"
+    client.revision = "abc123"
+    client.occurrence_folder = str(tmpdir)
+    return client
+
+
+def saved(client):
+    """
+    Return the arguments of the one occurrence `client` has saved.
+    """
+    folder = client.get_occurrence_folder()
+    names = os.listdir(folder)
+    assert len(names) == 1
+    with open(os.path.join(folder, names[0]), "rb") as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+class NotifyServer(ThreadingMixIn, HTTPServer):
+    """
+    A Squash server on localhost that keeps `(path, args)` for each occurrence posted to it. It answers
+    with the next status in `statuses`, or 200 once they are used up, after `delay` seconds. If
+    `dropConnections` is set, it closes each connection after answering, without saying so.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _NotifyHandler)
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+        self.received = []
+        self.statuses = []
+        self.delay = 0
+        self.dropConnections = False
+
+
+class _NotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        server.received.append((self.path, json.loads(body.decode('utf-8'))))
+        if server.delay:
+            time.sleep(server.delay)
+        self.send_response(server.statuses.pop(0) if server.statuses else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        if server.dropConnections:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = NotifyServer()
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
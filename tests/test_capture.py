@@ -0,0 +1,121 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+import gc
+import sys
+import threading
+import weakref
+
+import pytest
+
+from squash_python.capture import FutureWatch
+
+from conftest import saved
+
+
+class Queue(object):
+    def __init__(self):
+        self.items = []
+
+    def put(self, exc_type, exc_value, exc_traceback, origin, thread=None, fields=None, fatal=False):
+        self.items.append((exc_type, exc_value, origin, fields))
+
+
+def fail():
+    raise ValueError("from a future")
+
+
+def watched(queue, func):
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(func)
+        FutureWatch(queue, future)
+    return future
+
+
+def test_unretrieved_future_recorded_when_collected():
+    queue = Queue()
+    future = watched(queue, fail)
+    assert queue.items == []
+    del future
+    gc.collect()
+    assert [(exc_type, origin) for exc_type, exc_value, origin, fields in queue.items] == [(ValueError, 'future')]
+
+
+def test_retrieved_future_not_recorded():
+    queue = Queue()
+    future = watched(queue, fail)
+    with pytest.raises(ValueError):
+        future.result()
+    other = watched(queue, fail)
+    assert isinstance(other.exception(), ValueError)
+    del future, other
+    gc.collect()
+    assert queue.items == []
+
+
+def test_successful_and_cancelled_futures_not_recorded():
+    queue = Queue()
+    future = watched(queue, lambda: 1)
+    with ThreadPoolExecutor(1) as executor:
+        blocker = threading.Event()
+        executor.submit(blocker.wait)
+        cancelled = executor.submit(fail)
+        FutureWatch(queue, cancelled)
+        assert cancelled.cancel()
+        blocker.set()
+    del future, cancelled
+    gc.collect()
+    assert queue.items == []
+
+
+def test_watch_future_records_through_client(client):
+    with ThreadPoolExecutor(1) as executor:
+        future = executor.submit(fail)
+        assert client.watchFuture(future) is future
+    del future
+    gc.collect()
+    client.captureQueue.flush()
+    args = saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['origin'] == 'future'
+
+
+@pytest.mark.skipif(not hasattr(threading, 'excepthook'), reason="needs Python 3.8")
+def test_thread_exception(client, monkeypatch):
+    monkeypatch.setattr(threading, 'excepthook', client.threadExcepthook)
+    client.old_threading_excepthook = lambda args: None
+    thread = threading.Thread(target=fail, name="worker")
+    thread.start()
+    thread.join()
+    client.captureQueue.flush()
+    args = saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['origin'] == 'thread'
+    assert args['thread_name'] == "worker"
+
+
+class Unraisable(object):
+    instances = []
+
+    def __init__(self):
+        Unraisable.instances.append(weakref.ref(self))
+
+    def __del__(self):
+        raise KeyError("in __del__")
+
+
+@pytest.mark.skipif(not hasattr(sys, 'unraisablehook'), reason="needs Python 3.8")
+def test_unraisable_exception_does_not_keep_object(client, monkeypatch):
+    monkeypatch.setattr(sys, 'unraisablehook', client.unraisablehook)
+    client.old_unraisablehook = lambda unraisable: None
+    Unraisable.instances = []
+    Unraisable()
+    gc.collect()
+    assert [ref() for ref in Unraisable.instances] == [None]
+
+    client.captureQueue.flush()
+    args = saved(client)
+    assert args['class_name'] == "KeyError"
+    assert args['origin'] == 'unraisable'
+    assert args['unraisable_object'] == "Unraisable.__del__"
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == '__del__'
@@ -0,0 +1,69 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import uuid
+
+from squash_python.drain import DrainScheduler, entry_priority, entry_time
+from squash_python.occurrence import FATAL_PRIORITY, HANDLED_PRIORITY, SIGNAL_PRIORITY
+from squash_python.spool import write_occurrence
+
+
+def save(folder, priority):
+    args = {'UUID': str(uuid.uuid1()), 'class_name': "Error", 'message': "priority %d" % priority}
+    write_occurrence(str(folder), args, priority=priority)
+    return "%d-%s" % (priority, args['UUID'])
+
+
+def test_entry_priority():
+    name = str(uuid.uuid1())
+    assert entry_priority("%d-%s" % (SIGNAL_PRIORITY, name)) == SIGNAL_PRIORITY
+    assert entry_priority("%d-%s" % (FATAL_PRIORITY, name)) == FATAL_PRIORITY
+    assert entry_priority(name) == HANDLED_PRIORITY
+
+
+def test_entry_time():
+    first = uuid.uuid1()
+    second = uuid.uuid1()
+    assert entry_time(str(first)) == first.time
+    assert entry_time("1-%s" % second) == second.time
+    assert entry_time(str(uuid.uuid4())) == 0
+    assert entry_time("notes.txt") == 0
+
+
+def test_drain_order(tmpdir):
+    names = [save(tmpdir, priority) for priority in
+             (HANDLED_PRIORITY, FATAL_PRIORITY, SIGNAL_PRIORITY, HANDLED_PRIORITY, SIGNAL_PRIORITY, FATAL_PRIORITY)]
+    tmpdir.join(".partial").write("")
+    expected = sorted(names, key=lambda name: (entry_priority(name), names.index(name)))
+
+    entries = list(DrainScheduler(str(tmpdir)))
+    assert [entry.name for entry in entries] == expected
+    assert [entry.path for entry in entries] == [os.path.join(str(tmpdir), name) for name in expected]
+
+
+def test_drain_keeps_most_urgent(tmpdir):
+    names = [save(tmpdir, priority) for priority in (HANDLED_PRIORITY, FATAL_PRIORITY, HANDLED_PRIORITY, SIGNAL_PRIORITY)]
+    scheduler = DrainScheduler(str(tmpdir), requestsPerSecond=1, timeSlice=1)
+    assert list(scheduler.ordered_names()) == [names[3], names[1]]
+
+
+def test_drain_in_batches(tmpdir):
+    names = [save(tmpdir, priority) for priority in
+             (HANDLED_PRIORITY, FATAL_PRIORITY, SIGNAL_PRIORITY) * 4]
+    expected = sorted(names, key=lambda name: (entry_priority(name), names.index(name)))
+    assert list(DrainScheduler(str(tmpdir), batchSize=5).ordered_names()) == expected
+    assert list(DrainScheduler(str(tmpdir), batchSize=4).ordered_names()) == expected
+    assert list(DrainScheduler(str(tmpdir), requestsPerSecond=6, timeSlice=1, batchSize=4).ordered_names()) == \
+        expected[:7]
+
+
+def test_drain_batch_skips_sent(tmpdir):
+    names = [save(tmpdir, HANDLED_PRIORITY) for i in range(6)]
+    sent = []
+    for entry in DrainScheduler(str(tmpdir), batchSize=2):
+        sent.append(entry.name)
+        entry.delete()
+        if len(sent) == 3:
+            save(tmpdir, SIGNAL_PRIORITY)  # Sorts before the names already sent, so left for the next drain
+    assert sent == names
+    assert [entry_priority(name) for name in os.listdir(str(tmpdir))] == [SIGNAL_PRIORITY]
@@ -0,0 +1,134 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from squash_python import forwarder
+from squash_python.occurrence import FATAL_PRIORITY, HANDLED_PRIORITY, Occurrence
+from squash_python.spool import write_occurrence
+
+from conftest import saved
+
+pytestmark = pytest.mark.skipif(not hasattr(forwarder.socket, 'AF_UNIX'), reason="needs Unix domain sockets")
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+@pytest.fixture
+def daemon(tmpdir, server):
+    folder = tmpdir.mkdir("forwarder")
+    daemon = forwarder.SquashForwarder(str(folder.join("squash.sock")), connections=1, timeout=2,
+                                       occurrence_folder=str(folder.join("spool")), hosts=[server.url],
+                                       retryInterval=0)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.daemon = True
+    thread.start()
+    assert wait_for(lambda: daemon._server is not None and os.path.exists(daemon.socket_path))
+    yield daemon
+    daemon._server.shutdown()
+    thread.join()
+
+
+def make_args(uuid="a0a5c5b4-0f4e-11ef-9f1a-0242ac120002"):
+    return {'UUID': uuid, 'api_key': "key", 'class_name': "ValueError", 'message': "bad"}
+
+
+def posted(server, index=0):
+    # Without the field `SquashUploader` adds to every occurrence.
+    path, args = server.received[index]
+    args = dict(args)
+    args.pop('utf8', None)
+    return path, args
+
+
+def spooled(daemon):
+    folder = os.path.join(daemon.occurrence_folder, "key")
+    return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+
+def test_send_occurrence(daemon, server):
+    data = json.dumps(make_args())
+    assert forwarder.send_occurrence(daemon.socket_path, server.url, "/api/1.0/notify", data)
+    assert wait_for(lambda: server.received)
+    assert posted(server) == ("/api/1.0/notify", make_args())
+
+
+def test_send_occurrence_without_daemon(tmpdir, server):
+    assert not forwarder.send_occurrence(str(tmpdir.join("missing.sock")), server.url, "/api/1.0/notify", "{}")
+
+
+def test_untrusted_peer_refused(daemon, server, monkeypatch):
+    monkeypatch.setattr(forwarder, '_peer_uid', lambda sock, socket_path: 12345)
+    data = json.dumps(make_args())
+    assert not forwarder.send_occurrence(daemon.socket_path, server.url, "/api/1.0/notify", data)
+    assert forwarder.send_occurrence(daemon.socket_path, server.url, "/api/1.0/notify", data, trusted_uids=(12345,))
+
+
+def test_unconfigured_host_refused(daemon, server):
+    data = json.dumps(make_args())
+    assert not forwarder.send_occurrence(daemon.socket_path, "http://elsewhere.example.com", "/api/1.0/notify", data)
+    assert not forwarder.send_occurrence(daemon.socket_path, server.url, "/other", data)
+    assert not daemon.enqueue("http://elsewhere.example.com", "/api/1.0/notify", make_args())
+    assert daemon.enqueue(server.url + "/", "/api/1.0/notify", make_args())
+
+
+def test_malformed_envelope_refused(daemon):
+    sock = forwarder.socket.socket(forwarder.socket.AF_UNIX, forwarder.socket.SOCK_STREAM)
+    try:
+        sock.connect(daemon.socket_path)
+        sock.sendall(b"not json")
+        sock.shutdown(forwarder.socket.SHUT_WR)
+        assert sock.recv(1) == forwarder.REFUSED
+    finally:
+        sock.close()
+
+
+def test_failed_upload_spooled_and_resent(daemon, server):
+    server.statuses = [500]
+    data = json.dumps(make_args())
+    assert forwarder.send_occurrence(daemon.socket_path, server.url, "/api/1.0/notify", data, priority=FATAL_PRIORITY)
+    assert wait_for(lambda: spooled(daemon))
+    name, = spooled(daemon)
+    assert name == "%d-%s" % (FATAL_PRIORITY, make_args()['UUID'])
+
+    assert daemon.resend() == 1
+    assert wait_for(lambda: len(server.received) == 2)
+    assert posted(server, 1) == ("/api/1.0/notify", make_args())
+    assert spooled(daemon) == []
+
+
+def test_resend_skips_unconfigured_host(daemon, server):
+    folder = os.path.join(daemon.occurrence_folder, "key")
+    os.makedirs(folder)
+    args = make_args()
+    args[forwarder.host_key] = "http://elsewhere.example.com"
+    write_occurrence(folder, args)
+    # Saved without a host, as by an application: sent to the only configured server.
+    write_occurrence(folder, make_args("b0a5c5b4-0f4e-11ef-9f1a-0242ac120002"))
+    assert daemon.resend() == 1
+    assert wait_for(lambda: server.received)
+    assert server.received[0][1]['UUID'] == "b0a5c5b4-0f4e-11ef-9f1a-0242ac120002"
+    assert spooled(daemon) == ["%d-%s" % (HANDLED_PRIORITY, make_args()['UUID'])]
+
+
+def test_record_through_forwarder(daemon, server, client):
+    client.host = server.url
+    client.forwarderSocket = daemon.socket_path
+    client.record(Occurrence.from_stack("ValueError", "bad", [("app.py", 1, "f")]))
+    assert wait_for(lambda: server.received)
+    args = server.received[0][1]
+    assert args['class_name'] == "ValueError"
+    assert args['api_key'] == "key"
+    assert not os.listdir(client.get_occurrence_folder())
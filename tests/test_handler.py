@@ -0,0 +1,97 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import logging
+import os
+
+import pytest
+
+from squash_python import LocalsCapture, SquashHandler
+
+from conftest import saved
+
+
+@pytest.fixture
+def logger(client):
+    handler = SquashHandler(client, flushInterval=60)
+    logger = logging.getLogger("squash_python.tests.%s" % id(handler))
+    logger.propagate = False
+    logger.addHandler(handler)
+    yield logger
+    logger.removeHandler(handler)
+    handler.close()
+
+
+def handler_of(logger):
+    return logger.handlers[0]
+
+
+def all_saved(client):
+    folder = client.get_occurrence_folder()
+    occurrences = []
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name), "rb") as f:
+            occurrences.append(json.loads(f.read().decode('utf-8')))
+    return occurrences
+
+
+def log_error(logger, message="failed", exc_class=ValueError):
+    try:
+        local_value = 42
+        raise exc_class("bad")
+    except exc_class:
+        logger.exception(message)
+
+
+def test_logged_exception_recorded(client, logger):
+    client.localsCapture = LocalsCapture(frames=1)
+    log_error(logger, "failed %d")
+    handler_of(logger).flush()
+    args = saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['log_message'] == "failed %d"
+    assert args['logger_name'] == logger.name
+    assert args['frame_locals'][0]['local_value'] == "42"
+    assert 'repeat_count' not in args
+
+
+def test_repeats_counted(client, logger):
+    handler = handler_of(logger)
+    handler.dedupInterval = 60
+    for i in range(5):
+        log_error(logger)
+    handler.flush()
+    assert len(all_saved(client)) == 1
+
+    handler.dedupInterval = 0
+    log_error(logger)
+    handler.flush()
+    repeats = [args.get('repeat_count') for args in all_saved(client)]
+    assert sorted(repeats, key=lambda n: n or 0) == [None, 4]
+
+
+def test_error_level_without_exception(client, logger):
+    handler_of(logger).errorLevel = logging.ERROR
+    logger.warning("only a warning")
+    logger.error("an error")
+    handler_of(logger).flush()
+    args = saved(client)
+    assert args['class_name'] == "Logged ERROR"
+    assert args['message'] == "an error"
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == 'test_error_level_without_exception'
+
+
+def test_ignored_exception_skipped(client, logger):
+    client.ignoredExceptions.add('KeyError')
+    log_error(logger, exc_class=KeyError)
+    handler_of(logger).flush()
+    assert all_saved(client) == []
+
+
+def test_memory_error_goes_through_record_exception(client, logger):
+    client.memoryReserve = 1024
+    log_error(logger, exc_class=MemoryError)
+    handler_of(logger).flush()
+    args = saved(client)
+    assert args['capture_level'] == 'minimal'
+    assert args['log_message'] == "failed"
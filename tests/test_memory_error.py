@@ -0,0 +1,50 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+from conftest import saved
+
+
+def raise_nested(depth):
+    if depth:
+        raise_nested(depth - 1)
+    raise MemoryError("out of memory")
+
+
+def memory_error(depth=20):
+    try:
+        raise_nested(depth)
+    except MemoryError:
+        return sys.exc_info()
+
+
+def test_memory_error_recorded_in_full_by_default(client):
+    client.recordException(*memory_error())
+    args = saved(client)
+    assert args['capture_level'] == 'full'
+    assert len(args['backtraces'][0]['backtrace']) == 22
+    assert 'env_vars' in args
+    assert 'allocation_summary' not in args
+
+
+def test_memory_error_with_reserve(client):
+    client.memoryReserve = 1024
+    client.args = {'user': 'me'}
+    client.reserveMemory()
+    client.recordException(*memory_error(), fatal=True)
+    args = saved(client)
+    assert args['capture_level'] == 'minimal'
+    assert len(args['backtraces'][0]['backtrace']) == 22
+    assert 'env_vars' not in args
+    assert args['user'] == 'me'
+    assert args['client'] == "squash_python"
+    assert client._reserve is not None
+
+
+def test_other_exceptions_unaffected_by_reserve(client):
+    client.memoryReserve = 1024
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        client.recordException(*sys.exc_info())
+    assert saved(client)['capture_level'] == 'full'
@@ -0,0 +1,125 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import asyncio
+import os
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+
+from squash_python import SquashWSGIMiddleware
+from squash_python.asgi import SquashASGIMiddleware
+
+from conftest import saved
+
+
+def environ(**extra):
+    environ = {
+        'REQUEST_METHOD': "POST",
+        'PATH_INFO': "/orders/private-token",
+        'QUERY_STRING': "page=2",
+        'HTTP_AUTHORIZATION': "Bearer abc",
+        'HTTP_X_REQUEST_ID': "private-token-1",
+    }
+    environ.update(extra)
+    setup_testing_defaults(environ)
+    return environ
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def ok_app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"ok"]
+
+
+def failing_app(environ, start_response):
+    raise ValueError("request failed")
+
+
+def streaming_app(environ, start_response):
+    start_response("200 OK", [])
+    yield b"partial"
+    raise ValueError("while streaming")
+
+
+def test_wsgi_success_records_nothing(client):
+    app = SquashWSGIMiddleware(ok_app, client)
+    assert app(environ(), start_response) == [b"ok"]
+    assert os.listdir(client.get_occurrence_folder()) == []
+
+
+def test_wsgi_exception_recorded(client):
+    client.filterStrings = ["private-token"]
+    app = SquashWSGIMiddleware(failing_app, client)
+    with pytest.raises(ValueError):
+        app(environ(), start_response)
+    args = saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['request_method'] == "POST"
+    assert args['path'] == "/orders/[REDACTED]"
+    assert args['query'] == "page=2"
+    assert args['headers']['Authorization'] == "[REDACTED]"
+    assert args['headers']['X-Request-Id'] == "[REDACTED]-1"
+    assert args['request_duration_ms'] >= 0
+
+
+def test_wsgi_streaming_exception(client):
+    app = SquashWSGIMiddleware(streaming_app, client, captureStreaming=True)
+    with pytest.raises(ValueError):
+        list(app(environ(), start_response))
+    assert saved(client)['message'] == "while streaming"
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def scope(type='http'):
+    return {
+        'type': type,
+        'method': "GET",
+        'scheme': "https",
+        'server': ("example.com", 443),
+        'path': "/items",
+        'query_string': b"q=1",
+        'headers': [(b"cookie", b"session=1"), (b"user-agent", b"test")],
+    }
+
+
+async def receive():
+    return {'type': 'http.request'}
+
+
+async def send(message):
+    pass
+
+
+def test_asgi_exception_recorded(client):
+    async def app(scope, receive, send):
+        raise KeyError("missing")
+
+    with pytest.raises(KeyError):
+        run(SquashASGIMiddleware(app, client)(scope(), receive, send))
+    args = saved(client)
+    assert args['class_name'] == "KeyError"
+    assert args['request_method'] == "GET"
+    assert args['host'] == "example.com"
+    assert args['port'] == 443
+    assert args['path'] == "/items"
+    assert args['query'] == "q=1"
+    assert args['headers'] == {'cookie': "[REDACTED]", 'user-agent': "test"}
+
+
+def test_asgi_lifespan_passed_through(client):
+    async def app(scope, receive, send):
+        raise RuntimeError("lifespan")
+
+    with pytest.raises(RuntimeError):
+        run(SquashASGIMiddleware(app, client)(scope('lifespan'), receive, send))
+    assert os.listdir(client.get_occurrence_folder()) == []
@@ -0,0 +1,162 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+
+from squash_python.occurrence import Occurrence, capture_levels, get_exc_backtrace, minimal_message_length, \
+    trimmed_frames, trimmed_message_length
+
+from conftest import saved
+
+
+def raise_nested(depth, message):
+    if depth:
+        raise_nested(depth - 1, message)
+    raise ValueError(message)
+
+
+def exc_info(depth=3, message="bad value"):
+    try:
+        raise_nested(depth, message)
+    except ValueError:
+        return sys.exc_info()
+
+
+def eager_args(exc_type, exc_value, exc_traceback):
+    # The dictionary `Occurrence.from_exception` built before occurrences were kept compact.
+    return {
+        'message': str(exc_value),
+        'class_name': exc_type.__name__,
+        'backtraces': [{
+            "name": "Crashed Thread",
+            "faulted": True,
+            "backtrace": get_exc_backtrace(exc_traceback),
+        }],
+    }
+
+
+def test_to_dict_matches_eager_args():
+    info = exc_info()
+    occ = Occurrence.from_exception(*info)
+    args = occ.to_dict()
+    assert args.pop('capture_level') == 'full'
+    assert args == eager_args(*info)
+
+
+def test_args_is_built_once_and_kept():
+    occ = Occurrence.from_exception(*exc_info())
+    args = occ.args
+    occ.set('extra', 1)
+    assert occ.args is args
+    assert args['extra'] == 1
+
+
+def test_shared_overrides_fields():
+    occ = Occurrence.from_exception(*exc_info())
+    occ.update({'pid': -1, 'tag': 'occurrence'})
+    first = {'pid': 1, 'tag': 'first'}
+    second = {'tag': 'second'}
+    occ.add_shared(first)
+    occ.add_shared(second)
+    assert occ.get('pid') == 1
+    assert occ.get('tag') == 'second'
+    args = occ.to_dict()
+    assert args['pid'] == 1
+    assert args['tag'] == 'second'
+
+
+def test_record_precedence(client):
+    # As before: the required and process fields override those given to `recordException`, and
+    # `client.args` overrides everything.
+    client.args = {'environment': 'from client args', 'custom': 'client'}
+    client.recordException(*exc_info(), args={'pid': -1, 'revision': 'from record args', 'custom': 'record',
+                                              'own': 'record'})
+    args = saved(client)
+    assert args['pid'] == os.getpid()
+    assert args['revision'] == "abc123"
+    assert args['environment'] == 'from client args'
+    assert args['custom'] == 'client'
+    assert args['own'] == 'record'
+    assert args['client'] == "squash_python"
+
+
+def test_degrade_full_is_unchanged():
+    info = exc_info()
+    occ = Occurrence.from_exception(*info)
+    occ.degrade('full')
+    assert occ.level == 'full'
+    args = occ.to_dict()
+    args.pop('capture_level')
+    assert args == eager_args(*info)
+
+
+def test_degrade_trimmed():
+    occ = Occurrence.from_exception(*exc_info(depth=trimmed_frames + 10, message="x" * (trimmed_message_length * 2)))
+    occ.set('frame_locals', [{'a': '1'}])
+    occ.set('custom', 1)
+    occ.add_shared({'pid': 1})
+    occ.add_thread("Other", [("other.py", 1, "f")] * (trimmed_frames + 5))
+    occ.degrade('trimmed')
+
+    args = occ.to_dict()
+    assert args['capture_level'] == 'trimmed'
+    assert len(args['message']) == trimmed_message_length
+    assert len(args['backtraces'][0]['backtrace']) == trimmed_frames
+    assert len(args['backtraces'][1]['backtrace']) == trimmed_frames
+    assert 'frame_locals' not in args
+    assert args['custom'] == 1
+    assert args['pid'] == 1
+
+
+def test_degrade_minimal():
+    occ = Occurrence.from_exception(*exc_info(message="x" * (trimmed_message_length * 2)))
+    occ.set('frame_locals', [{'a': '1'}])
+    occ.set('frame_locals_truncated', True)
+    occ.set('custom', 1)
+    occ.add_shared({'pid': 1})
+    occ.add_shared({'user': 'kept'}, minimal=True)
+    occ.add_thread("Other", [("other.py", 1, "f")])
+    occ.degrade('minimal')
+    occ.add_shared({'arch': 'dropped'})
+    occ.add_shared({'later': 'kept'}, minimal=True)
+
+    args = occ.to_dict()
+    assert args['capture_level'] == 'minimal'
+    assert len(args['message']) == minimal_message_length
+    assert len(args['backtraces']) == 1
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == 'raise_nested'
+    assert len(args['backtraces'][0]['backtrace']) == 1
+    assert 'frame_locals' not in args
+    assert 'frame_locals_truncated' not in args
+    assert 'pid' not in args
+    assert 'arch' not in args
+    assert args['custom'] == 1
+    assert args['user'] == 'kept'
+    assert args['later'] == 'kept'
+
+
+def test_degrade_only_reduces():
+    occ = Occurrence.from_exception(*exc_info())
+    occ.degrade('minimal')
+    occ.degrade('trimmed')
+    assert occ.level == 'minimal'
+    assert capture_levels.index(occ.level) == len(capture_levels) - 1
+
+
+def test_degrade_leaves_complete_args():
+    args = eager_args(*exc_info())
+    occ = Occurrence(args)
+    occ.degrade('minimal')
+    assert occ.to_dict() is args
+    assert 'capture_level' not in args
+
+
+def test_minimal_record_keeps_required_fields(client):
+    client.args = {'user': 'me'}
+    occ = Occurrence.from_exception(*exc_info())
+    occ.degrade('minimal')
+    client.record(occ)
+    args = saved(client)
+    for key in ('api_key', 'environment', 'UUID', 'client', 'occurred_at', 'revision', 'user'):
+        assert key in args
+    assert 'env_vars' not in args
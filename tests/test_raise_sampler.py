@@ -0,0 +1,79 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from squash_python.raise_sampler import RaiseSampler
+
+pytestmark = pytest.mark.skipif(not hasattr(sys, 'monitoring'), reason="needs sys.monitoring, from Python 3.12")
+
+
+@pytest.fixture
+def sampler(client):
+    sampler = RaiseSampler(client, [__name__], flushInterval=3600, samplesPerSecond=1, maxFingerprints=1)
+    sampler.start()
+    yield sampler
+    sampler.stop()
+
+
+def all_saved(client):
+    folder = client.get_occurrence_folder()
+    occurrences = []
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name), "rb") as f:
+            occurrences.append(json.loads(f.read().decode('utf-8')))
+    return occurrences
+
+
+def swallow(exc_class, times=1):
+    for i in range(times):
+        try:
+            raise exc_class("swallowed %d" % i)
+        except exc_class:
+            pass
+
+
+def test_swallowed_exceptions_counted(client, sampler):
+    swallow(ValueError, 5)
+    sampler.flush()
+    args, = all_saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['raise_count'] == 5
+    assert args['origin'] == 'raise_sampler'
+    assert args['sampled_message'] == "swallowed 0"
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == 'swallow'
+
+
+def test_control_flow_and_ignored_exceptions_take_no_slot(client, sampler):
+    client.ignoredExceptions.add('KeyError')
+    swallow(StopIteration, 3)
+    swallow(KeyError, 3)
+    # The only fingerprint slot and sample are still free.
+    swallow(ValueError, 2)
+    sampler.flush()
+    args, = all_saved(client)
+    assert args['class_name'] == "ValueError"
+    assert args['raise_count'] == 2
+    assert 'sampled_message' in args
+
+
+def test_disabled_when_raising_too_often(client):
+    sampler = RaiseSampler(client, [__name__], flushInterval=3600, maxRaisesPerSecond=100)
+    sampler.start()
+    try:
+        end = time.time() + 1.5
+        while sampler.disabledReason is None and time.time() < end:
+            swallow(ValueError, 100)
+        assert "exceptions raised per second" in sampler.disabledReason
+        assert sampler._tool is None
+        events = sampler._events
+        swallow(ValueError, 10)
+        assert sampler._events == events
+    finally:
+        sampler.stop()
+    # A raise being counted as the sampler turned off may be left for the flush made by `stop`.
+    assert sum(args['raise_count'] for args in all_saved(client)) > 100
@@ -0,0 +1,161 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+from squash_python import squash_spool
+from squash_python.drain import entry_priority, entry_time
+from squash_python.occurrence import FATAL_PRIORITY, HANDLED_PRIORITY
+from squash_python.spool import fingerprint, write_occurrence
+
+
+def make_args(class_name, api_key="key", symbol="f"):
+    return {
+        'UUID': str(uuid.uuid1()),
+        'api_key': api_key,
+        'class_name': class_name,
+        'message': "%s happened" % class_name,
+        'backtraces': [{"name": "Crashed Thread", "faulted": True,
+                        "backtrace": [{"file": "app.py", "line": 1, "symbol": symbol}]}],
+    }
+
+
+@pytest.fixture
+def spool(tmpdir):
+    root = tmpdir.mkdir("spool")
+    for api_key in ("key", "other"):
+        root.mkdir(api_key)
+    occurrences = [
+        (make_args("ValueError"), HANDLED_PRIORITY),
+        (make_args("ValueError"), FATAL_PRIORITY),
+        (make_args("KeyError", symbol="g"), HANDLED_PRIORITY),
+        (make_args("KeyError", api_key="other"), HANDLED_PRIORITY),
+    ]
+    for args, priority in occurrences:
+        write_occurrence(str(root.join(args['api_key'])), args, priority=priority)
+    return root
+
+
+def run(monkeypatch, *argv):
+    monkeypatch.setattr(sys, 'argv', ["squash_spool"] + [str(arg) for arg in argv])
+    return squash_spool.main()
+
+
+def names(folder):
+    return sorted(name for name in os.listdir(str(folder)) if not name.startswith('.'))
+
+
+def test_parse_age():
+    assert squash_spool.parse_age("90") == 90
+    assert squash_spool.parse_age("30m") == 1800
+    assert squash_spool.parse_age("2H") == 7200
+    assert squash_spool.parse_age("7d") == 604800
+
+
+def test_stats(spool, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "stats") == 0
+    out = capsys.readouterr().out
+    assert "Occurrences: 4" in out
+    assert "       2  ValueError" in out
+    assert "       2  KeyError" in out
+    assert "       4  < 1 hour" in out
+
+
+def test_list(spool, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "list", "-k", "key", "-c", "ValueError") == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert all("ValueError: ValueError happened" in line for line in lines)
+
+
+def test_list_fingerprint(spool, monkeypatch, capsys):
+    fp = fingerprint(make_args("KeyError", symbol="g"))
+    assert run(monkeypatch, "-d", spool, "list", "-f", fp) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert fp in lines[0]
+
+
+def test_export_import(spool, tmpdir, monkeypatch, capsys):
+    exported = tmpdir.join("export.jsonl")
+    assert run(monkeypatch, "-d", spool, "export", "-k", "key", "-o", exported) == 0
+    lines = [json.loads(line) for line in exported.readlines()]
+    assert len(lines) == 3
+    assert sorted(args[squash_spool.priority_key] for args in lines) == [FATAL_PRIORITY, HANDLED_PRIORITY,
+                                                                         HANDLED_PRIORITY]
+
+    target = tmpdir.mkdir("target")
+    assert run(monkeypatch, "-d", target, "import", exported) == 0
+    assert "Imported 3 occurrences." in capsys.readouterr().out
+    assert names(target.join("key")) == names(spool.join("key"))
+    for name in names(target.join("key")):
+        args = json.loads(target.join("key", name).read())
+        assert squash_spool.priority_key not in args
+
+
+def test_import_api_key_and_bad_lines(tmpdir, monkeypatch, capsys):
+    source = tmpdir.join("import.jsonl")
+    source.write("\n".join([json.dumps(make_args("ValueError")), "not json", json.dumps({'api_key': "key"}), ""]))
+    target = tmpdir.mkdir("target")
+    assert run(monkeypatch, "-d", target, "import", "-k", "new", source) == 0
+    assert "Imported 1 occurrences." in capsys.readouterr().out
+    assert os.listdir(str(target)) == ["new"]
+    assert len(names(target.join("new"))) == 1
+
+
+def test_import_priority_out_of_range(tmpdir, monkeypatch, capsys):
+    lines = []
+    for priority in (10, -1, "x", FATAL_PRIORITY):
+        args = make_args("ValueError")
+        args[squash_spool.priority_key] = priority
+        lines.append(json.dumps(args))
+    source = tmpdir.join("import.jsonl")
+    source.write("\n".join(lines))
+    target = tmpdir.mkdir("target")
+    assert run(monkeypatch, "-d", target, "import", source) == 0
+    assert "Imported 3 occurrences." in capsys.readouterr().out
+    saved = names(target.join("key"))
+    assert sorted(entry_priority(name) for name in saved) == [FATAL_PRIORITY, HANDLED_PRIORITY, HANDLED_PRIORITY]
+    assert all(entry_time(name) for name in saved)
+
+
+def test_purge_needs_filter(spool, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "purge") == 2
+    assert len(names(spool.join("key"))) == 3
+
+
+def test_purge(spool, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "purge", "-c", "KeyError", "-n") == 0
+    assert "Would delete 2 occurrences." in capsys.readouterr().out
+    assert len(names(spool.join("key"))) == 3
+
+    assert run(monkeypatch, "-d", spool, "purge", "-k", "other") == 0
+    assert "Deleted 1 occurrences." in capsys.readouterr().out
+    assert names(spool.join("other")) == []
+    assert len(names(spool.join("key"))) == 3
+
+    assert run(monkeypatch, "-d", spool, "purge", "--all") == 0
+    assert names(spool.join("key")) == []
+
+
+def test_replay_unreachable_host_keeps_occurrences(spool, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "replay", "-k", "other", "http://127.0.0.1:1", "-t", "1") == 1
+    assert "Sent 0 occurrences, 1 failed." in capsys.readouterr().out
+    assert len(names(spool.join("other"))) == 1
+
+
+def test_replay(spool, server, monkeypatch, capsys):
+    assert run(monkeypatch, "-d", spool, "replay", "-k", "key", "--keep", server.url) == 0
+    assert "Sent 3 occurrences, 0 failed." in capsys.readouterr().out
+    assert len(names(spool.join("key"))) == 3
+
+    assert run(monkeypatch, "-d", spool, "replay", "-c", "KeyError", server.url, "--notify-path", "/notify") == 0
+    assert "Sent 2 occurrences, 0 failed." in capsys.readouterr().out
+    assert len(names(spool.join("key"))) == 2
+    assert names(spool.join("other")) == []
+    assert [path for path, args in server.received[3:]] == ["/notify", "/notify"]
+    assert all(args['class_name'] == "KeyError" for path, args in server.received[3:])
@@ -0,0 +1,47 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import os
+import sys
+
+import pytest
+
+import squash_python
+from squash_python import squash_tester
+
+
+def load_args(**kwargs):
+    args = dict(load=True, rate=50.0, duration=0.2, threads=1, processes=1, depth=5, message_size=20,
+                fingerprints=2)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def load_client(tmpdir, server, monkeypatch):
+    monkeypatch.setattr(squash_python.SquashClient, 'occurrence_folder', str(tmpdir))
+    client = squash_python.get_client()
+    monkeypatch.setattr(client, 'APIKey', "key")
+    monkeypatch.setattr(client, 'environment', "test")
+    monkeypatch.setattr(client, 'host', server.url)
+    monkeypatch.setattr(client, 'revision', "abc123")
+    return client
+
+
+def test_load_counts_accepted_uploads(load_client, server, capsys):
+    server.statuses = [500, 422, 503]
+    squash_tester.run_load(load_client, load_args())
+    out = capsys.readouterr().out
+    recorded = len(server.received)
+    assert recorded > 3
+    assert "Sent:            %d of %d occurrences" % (recorded - 3, recorded) in out
+    assert squash_python.SquashUploader is not squash_tester.CountingUploader
+    assert os.listdir(load_client.get_occurrence_folder()) == []
+
+
+def test_rate_must_be_positive(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ["squash_tester", "-L", "--rate", "0"])
+    with pytest.raises(SystemExit) as e:
+        squash_tester.main()
+    assert e.value.code == 2
+    assert "--rate must be greater than 0" in capsys.readouterr().err
@@ -0,0 +1,75 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import time
+
+import pytest
+
+from squash_python import timing
+
+from conftest import saved
+
+
+@pytest.fixture(autouse=True)
+def clear_reports():
+    timing._last_reports.clear()
+    yield
+    timing._last_reports.clear()
+
+
+def count(client):
+    return len(os.listdir(client.get_occurrence_folder()))
+
+
+def test_slow_block_recorded(client):
+    with client.timed("load config", threshold=0.001):
+        time.sleep(0.01)
+    args = saved(client)
+    assert args['class_name'] == "Slow Operation"
+    assert args['operation'] == "load config"
+    assert args['elapsed'] >= 0.01
+    assert args['threshold'] == 0.001
+
+
+def test_fast_block_not_recorded(client):
+    with client.timed("load config", threshold=10):
+        pass
+    assert count(client) == 0
+
+
+def test_decorated_function_named_after_it(client):
+    @client.timed(threshold=0.001)
+    def load():
+        time.sleep(0.01)
+        return 42
+
+    assert load() == 42
+    args = saved(client)
+    assert args['operation'].startswith("test_timing.")
+    assert args['operation'].endswith(".load")
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == "load"
+
+
+def test_exception_passes_through(client):
+    with pytest.raises(ValueError):
+        with client.timed("parse", threshold=0.001):
+            time.sleep(0.01)
+            raise ValueError("bad input")
+    assert saved(client)['operation'] == "parse"
+
+
+def test_rate_limited_per_operation(client):
+    for _ in range(3):
+        with client.timed("query", threshold=0.001, reportInterval=60):
+            time.sleep(0.005)
+    assert count(client) == 1
+
+    with client.timed("other query", threshold=0.001, reportInterval=60):
+        time.sleep(0.005)
+    assert count(client) == 2
+
+
+def test_sampled_out(client):
+    with client.timed("query", threshold=0.001, sampleRate=0):
+        time.sleep(0.005)
+    assert count(client) == 0
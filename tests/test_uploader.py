@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from squash_python.uploader import SquashUploader, urlerror
+
+
+def test_keepalive_reuses_connection(server):
+    uploader = SquashUploader(server.url, timeout=2, keepalive=True)
+    try:
+        uploader.transmit("/notify", {'n': 1})
+        connection = uploader._connection
+        uploader.transmit("/notify", {'n': 2})
+        assert uploader._connection is connection
+    finally:
+        uploader.close()
+    assert [args['n'] for path, args in server.received] == [1, 2]
+
+
+def test_stale_connection_resent_once(server):
+    server.dropConnections = True
+    uploader = SquashUploader(server.url, timeout=2, keepalive=True)
+    try:
+        for n in range(3):
+            uploader.transmit("/notify", {'n': n})
+    finally:
+        uploader.close()
+    assert [args['n'] for path, args in server.received] == [0, 1, 2]
+
+
+def test_timeout_not_resent(server):
+    uploader = SquashUploader(server.url, timeout=0.5, keepalive=True)
+    try:
+        uploader.transmit("/notify", {'n': 1})
+        server.delay = 1.0
+        with pytest.raises(urlerror.URLError):
+            uploader.transmit("/notify", {'n': 2})
+    finally:
+        uploader.close()
+    assert [args['n'] for path, args in server.received] == [1, 2]
+
+
+def test_http_error_raised(server):
+    server.statuses = [422]
+    uploader = SquashUploader(server.url, timeout=2, keepalive=True)
+    try:
+        with pytest.raises(urlerror.HTTPError) as e:
+            uploader.transmit("/notify", {'n': 1})
+        assert e.value.code == 422
+    finally:
+        uploader.close()
@@ -0,0 +1,116 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import threading
+import time
+
+import pytest
+
+from squash_python.watchdog import StallWatchdog
+
+
+class Recorder(object):
+    disabled = False
+
+    def __init__(self):
+        self.occurrences = []
+
+    def record(self, occ):
+        self.occurrences.append(occ)
+
+
+@pytest.fixture
+def watchdog():
+    return StallWatchdog(Recorder(), threshold=0.3, reportInterval=0)
+
+
+class Stop(object):
+    # `done` is read without calling anything, so no Python frame of ours is ever innermost.
+    def __init__(self):
+        self.done = False
+        self.event = threading.Event()
+
+    def set(self):
+        self.done = True
+        self.event.set()
+
+
+def watch(watchdog, target, duration=0.8):
+    """
+    Run `target(stop)` on a thread and check it as the main thread would be, until `duration` has passed.
+    """
+    stop = Stop()
+    thread = threading.Thread(target=target, args=(stop,))
+    thread.daemon = True
+    thread.start()
+    try:
+        end = time.time() + duration
+        while time.time() < end:
+            time.sleep(0.05)
+            watchdog.check_main(thread.ident)
+    finally:
+        stop.set()
+        thread.join()
+    return watchdog.client.occurrences
+
+
+def lock_wait(stop):
+    lock = threading.Lock()
+    lock.acquire()
+    while not lock.acquire(timeout=0.01) and not stop.done:
+        pass
+
+
+def busy_loop(stop):
+    while not stop.done:
+        pass
+
+
+def step():
+    return sum(range(100))
+
+
+def calling_loop(stop):
+    while not stop.done:
+        step()
+
+
+def event_wait(stop):
+    stop.event.wait()
+
+
+def test_lock_wait_is_a_stall(watchdog):
+    occurrences = watch(watchdog, lock_wait)
+    assert len(occurrences) == 1
+    args = occurrences[0].to_dict()
+    assert args['class_name'] == "Stall"
+    assert args['backtraces'][0]['backtrace'][0]['symbol'] == 'lock_wait'
+
+
+def test_busy_loop_is_a_stall(watchdog):
+    occurrences = watch(watchdog, busy_loop)
+    assert len(occurrences) == 1
+    assert occurrences[0].to_dict()['backtraces'][0]['backtrace'][0]['symbol'] == 'busy_loop'
+
+
+def test_loop_making_calls_is_not_a_stall(watchdog):
+    assert watch(watchdog, calling_loop) == []
+
+
+def test_idle_module_wait_is_not_a_stall(watchdog):
+    assert watch(watchdog, event_wait) == []
+
+
+def test_idle_block_is_not_a_stall(watchdog):
+    watchdog._main_ident = threading.current_thread().ident
+    with watchdog.idle():
+        assert watchdog._idle == 1
+        time.sleep(0.4)
+        watchdog.check_main(watchdog._main_ident)
+        time.sleep(0.4)
+        watchdog.check_main(watchdog._main_ident)
+    assert watchdog._idle == 0
+    assert watchdog.client.occurrences == []
+
+
+def test_stall_is_reported_once(watchdog):
+    assert len(watch(watchdog, busy_loop, duration=1.5)) == 1